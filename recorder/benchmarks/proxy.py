@@ -0,0 +1,129 @@
+"""
+Throughput and peak memory of forwarding device segments, for the old
+buffered httpx.get forward against DeviceProxy streaming.
+
+A fake device serving fixed-size segments and a proxy app run in-process on
+localhost. Each mode runs in its own process so peak RSS is comparable. Run
+from the recorder directory:
+
+    uv run python -m benchmarks.proxy
+"""
+
+import asyncio
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+import click
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.concurrency import run_in_threadpool
+
+from src.proxy import DeviceProxy
+
+DEVICE_PORT = 8791
+PROXY_PORT = 8792
+MODES = ["buffered", "streamed"]
+
+
+@click.command()
+@click.option("--mode", type=click.Choice(MODES), default=None)
+@click.option("--segment-size", default=2 * 1024 * 1024, show_default=True)
+@click.option("--concurrency", default=50, show_default=True)
+@click.option("--requests", "requests_", default=500, show_default=True)
+def main(mode: str | None, segment_size: int, concurrency: int, requests_: int) -> None:
+    if mode is None:
+        print(f"{'mode':>9} {'req/s':>7} {'MiB/s':>7} {'peak RSS MiB':>13}")
+        for mode in MODES:
+            subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    __spec__.name,  # type: ignore
+                    f"--mode={mode}",
+                    f"--segment-size={segment_size}",
+                    f"--concurrency={concurrency}",
+                    f"--requests={requests_}",
+                ],
+                check=True,
+            )
+        return
+    _serve(_device_app(segment_size), DEVICE_PORT)
+    _serve(_proxy_app(mode), PROXY_PORT)
+    baseline = _max_rss()
+    elapsed = asyncio.run(_load(concurrency, requests_))
+    print(
+        f"{mode:>9} {requests_ / elapsed:>7.1f} "
+        f"{requests_ * segment_size / elapsed / 2**20:>7.1f} "
+        f"{(_max_rss() - baseline) / 2**20:>13.1f}"
+    )
+
+
+def _device_app(segment_size: int) -> FastAPI:
+    app = FastAPI()
+    segment = b"\x47" * segment_size
+
+    @app.get("/segment/{i}")
+    async def get_segment(i: int) -> Response:
+        return Response(segment, media_type="video/mp2t")
+
+    return app
+
+
+def _proxy_app(mode: str) -> FastAPI:
+    app = FastAPI()
+    base_url = f"http://127.0.0.1:{DEVICE_PORT}"
+    proxy = DeviceProxy()
+
+    @app.get("/get/{path:path}")
+    async def forward(request: Request, path: str) -> Response:
+        if mode == "streamed":
+            return await proxy.forward(
+                base_url, path, request.query_params, request.headers
+            )
+        response = await run_in_threadpool(
+            httpx.get, f"{base_url}/{path}", timeout=20.0
+        )
+        return Response(
+            content=response.content,
+            status_code=response.status_code,
+            headers=dict(response.headers),
+        )
+
+    return app
+
+
+def _serve(app: FastAPI, port: int) -> None:
+    server = uvicorn.Server(uvicorn.Config(app, port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+
+async def _load(concurrency: int, requests_: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(timeout=60.0, limits=limits) as client:
+
+        async def fetch(i: int) -> None:
+            async with semaphore:
+                url = f"http://127.0.0.1:{PROXY_PORT}/get/segment/{i}"
+                async with client.stream("GET", url) as response:
+                    response.raise_for_status()
+                    async for _ in response.aiter_raw():
+                        pass
+
+        start = time.perf_counter()
+        await asyncio.gather(*(fetch(i) for i in range(requests_)))
+        return time.perf_counter() - start
+
+
+def _max_rss() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+if __name__ == "__main__":
+    main()
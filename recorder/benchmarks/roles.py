@@ -0,0 +1,157 @@
+"""
+Count the database writes role resolution makes per request, for the old
+per-request user upsert against get_role with the user cache.
+
+Some users are left out of the seed and some are seeded with a stale email, so
+both paths have real inserts and updates to make on first sight. Every commit
+is counted, and so is every transaction that wrote anything.
+
+Tokens are resolved by a static decoder so only the database is measured. Run
+from the recorder directory against a scratch database at alembic head:
+
+    DATABASE_URL=postgresql+psycopg://... uv run python -m benchmarks.roles
+"""
+
+import asyncio
+import time
+
+import click
+from fastapi import HTTPException
+from sqlalchemy import delete, event
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from src.auth.types import UID, DecodedToken, Email
+import src.db.models as models
+import src.db.queries as queries
+import main
+
+PREFIX = "bench-roles-"
+
+
+class StaticDecoder:
+    def decode(self, token: str) -> DecodedToken:
+        return DecodedToken(
+            uid=UID(token), email=Email(f"{token}@example.com"), provider="password"
+        )
+
+
+@click.command()
+@click.option("--users", default=10, show_default=True)
+@click.option("--requests", "requests_", default=1000, show_default=True)
+@click.option(
+    "--new-users", default=2, show_default=True, help="Users not in the seed."
+)
+@click.option(
+    "--changed-users",
+    default=2,
+    show_default=True,
+    help="Users seeded with an email that no longer matches their token.",
+)
+def main_(users: int, requests_: int, new_users: int, changed_users: int) -> None:
+    asyncio.run(_main(users, requests_, new_users, changed_users))
+
+
+async def _main(users: int, requests_: int, new_users: int, changed_users: int) -> None:
+    main.decoder = StaticDecoder()  # type: ignore
+    statements = writes = commits = write_transactions = 0
+    wrote = False
+
+    def count_write(conn, cursor, statement: str, *args) -> None:
+        nonlocal statements, writes, wrote
+        statements += 1
+        if statement.lstrip().split(None, 1)[0] in {"INSERT", "UPDATE", "DELETE"}:
+            writes += 1
+            wrote = True
+
+    def count_commit(conn) -> None:
+        nonlocal commits, write_transactions, wrote
+        commits += 1
+        write_transactions += wrote
+        wrote = False
+
+    def count_rollback(conn) -> None:
+        nonlocal wrote
+        wrote = False
+
+    event.listen(main.engine.sync_engine, "before_cursor_execute", count_write)
+    event.listen(main.engine.sync_engine, "commit", count_commit)
+    event.listen(main.engine.sync_engine, "rollback", count_rollback)
+    tokens = [f"{PREFIX}{i % users}" for i in range(requests_)]
+    print(
+        f"{'method':>8} {'requests':>9} {'statements':>11} {'writes':>7} "
+        f"{'commits':>8} {'write txns':>11} {'ms/req':>7}"
+    )
+    try:
+        for name, resolve in [("upsert", _upsert), ("cached", _cached)]:
+            await _seed(users, new_users, changed_users)
+            main.user_cache = main.UserCache(ttl=main.settings.user_cache_ttl)
+            statements = writes = commits = write_transactions = 0
+            start = time.perf_counter()
+            for token in tokens:
+                async with AsyncSession(main.engine, expire_on_commit=False) as session:
+                    await resolve(token, session)
+            elapsed = (time.perf_counter() - start) / requests_
+            print(
+                f"{name:>8} {requests_:>9} {statements:>11} {writes:>7} {commits:>8} "
+                f"{write_transactions:>11} {elapsed * 1000:>7.2f}"
+            )
+    finally:
+        await _clear()
+        await main.engine.dispose()
+
+
+async def _upsert(token: str, session: AsyncSession) -> models.Role | None:
+    """
+    Role resolution before the user cache: load, update from the token and
+    commit on every request.
+    """
+    decoded_token = main.decoder.decode(token)
+    user = await queries.get_user_by_uid(session, decoded_token.uid) or models.User(
+        uid=decoded_token.uid,
+        email=decoded_token.email,
+        role=None,
+        provider=decoded_token.provider,
+    )
+    user.email = decoded_token.email
+    user.provider = decoded_token.provider
+    await queries.add_user(session, user)
+    return user.role
+
+
+async def _cached(token: str, session: AsyncSession) -> models.Role | None:
+    try:
+        return await main.get_role(token, session)
+    except HTTPException:
+        # New users have no role yet, but are stored all the same.
+        return None
+
+
+async def _seed(users: int, new_users: int, changed_users: int) -> None:
+    await _clear()
+    async with AsyncSession(main.engine) as session:
+        session.add_all(
+            models.User(
+                uid=f"{PREFIX}{i}",
+                email=(
+                    f"{PREFIX}{i}@old.example.com"
+                    if i < new_users + changed_users
+                    else f"{PREFIX}{i}@example.com"
+                ),
+                role=models.Role.USER,
+                provider="password",
+            )
+            for i in range(new_users, users)
+        )
+        await session.commit()
+
+
+async def _clear() -> None:
+    async with AsyncSession(main.engine) as session:
+        await session.exec(
+            delete(models.User).where(models.User.uid.startswith(PREFIX))  # type: ignore
+        )
+        await session.commit()
+
+
+if __name__ == "__main__":
+    main_()
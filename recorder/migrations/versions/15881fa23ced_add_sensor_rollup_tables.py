@@ -0,0 +1,103 @@
+"""add sensor rollup tables
+
+Revision ID: 15881fa23ced
+Revises: 16d060e324b8
+Create Date: 2026-10-17 04:08:15.497005
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "15881fa23ced"
+down_revision: Union[str, Sequence[str], None] = "16d060e324b8"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+ROLLUPS = {"sensor_hourly": "hour", "sensor_daily": "day"}
+FIELDS = ("temperature", "humidity", "cpu_temperature")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table in ROLLUPS:
+        op.create_table(
+            table,
+            sa.Column("device_id", sa.Uuid(), nullable=False),
+            sa.Column("bucket", sa.DateTime(timezone=True), nullable=False),
+            sa.Column("count", sa.Integer(), nullable=False),
+            *(
+                sa.Column(f"{field}_{aggregate}", sa.Float(), nullable=True)
+                for field in FIELDS
+                for aggregate in ("min", "max", "avg")
+            ),
+            sa.ForeignKeyConstraint(["device_id"], ["device.id"]),
+            sa.PrimaryKeyConstraint("device_id", "bucket"),
+        )
+    inserts = ";".join(
+        _refresh_rollup_sql(t, u, "new_rows") for t, u in ROLLUPS.items()
+    )
+    op.execute(
+        f"""
+        CREATE FUNCTION refresh_sensor_rollups() RETURNS trigger AS $$
+        BEGIN
+            {inserts};
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER sensor_rollups
+        AFTER INSERT ON sensor
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION refresh_sensor_rollups()
+        """
+    )
+    for table, unit in ROLLUPS.items():
+        op.execute(_refresh_rollup_sql(table, unit, "sensor"))
+
+
+def _refresh_rollup_sql(table: str, unit: str, source: str) -> str:
+    aggregates = ", ".join(
+        f"{aggregate}(s.{field})"
+        for field in FIELDS
+        for aggregate in ("min", "max", "avg")
+    )
+    columns = ", ".join(
+        f"{field}_{aggregate}"
+        for field in FIELDS
+        for aggregate in ("min", "max", "avg")
+    )
+    updates = ", ".join(
+        f"{column} = EXCLUDED.{column}" for column in ["count", *columns.split(", ")]
+    )
+    return f"""
+        INSERT INTO {table} (device_id, bucket, count, {columns})
+        SELECT s.device_id, b.bucket, count(*), {aggregates}
+        FROM (
+            SELECT DISTINCT device_id, date_trunc('{unit}', created_at, 'UTC') AS bucket
+            FROM {source}
+        ) b
+        JOIN sensor s
+            ON s.device_id = b.device_id
+            AND s.created_at >= b.bucket
+            AND s.created_at < b.bucket + interval '1 {unit}'
+        WHERE s.temperature IS NULL OR s.temperature > -30
+        GROUP BY s.device_id, b.bucket
+        ON CONFLICT (device_id, bucket) DO UPDATE SET {updates}
+    """
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TRIGGER sensor_rollups ON sensor")
+    op.execute("DROP FUNCTION refresh_sensor_rollups()")
+    for table in ROLLUPS:
+        op.drop_table(table)
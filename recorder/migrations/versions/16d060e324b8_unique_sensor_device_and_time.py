@@ -0,0 +1,49 @@
+"""unique sensor device and time
+
+Revision ID: 16d060e324b8
+Revises: 46b0e06b0427
+Create Date: 2026-10-17 04:06:39.022536
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "16d060e324b8"
+down_revision: Union[str, Sequence[str], None] = "46b0e06b0427"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute(
+        """
+        DELETE FROM sensor
+        WHERE id IN (
+            SELECT id FROM (
+                SELECT
+                    id,
+                    row_number() OVER (
+                        PARTITION BY device_id, created_at ORDER BY id
+                    ) AS n
+                FROM sensor
+            ) duplicates
+            WHERE n > 1
+        )
+        """
+    )
+    op.create_index(
+        "ix_sensor_device_id_created_at",
+        "sensor",
+        ["device_id", "created_at"],
+        unique=True,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_sensor_device_id_created_at", table_name="sensor")
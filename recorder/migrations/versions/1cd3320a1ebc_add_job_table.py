@@ -0,0 +1,72 @@
+"""add job table
+
+Revision ID: 1cd3320a1ebc
+Revises: fac2587bff03
+Create Date: 2026-10-17 04:18:58.983599
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = "1cd3320a1ebc"
+down_revision: Union[str, Sequence[str], None] = "fac2587bff03"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "job",
+        sa.Column("id", sa.Uuid(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("kind", sa.Enum("record", name="job_kind_enum"), nullable=False),
+        sa.Column(
+            "status",
+            sa.Enum(
+                "pending",
+                "running",
+                "succeeded",
+                "failed",
+                "cancelled",
+                name="job_status_enum",
+            ),
+            nullable=False,
+        ),
+        sa.Column("device_id", sa.Uuid(), nullable=False),
+        sa.Column(
+            "params",
+            postgresql.JSONB(astext_type=sa.Text()),
+            server_default="{}",
+            nullable=False,
+        ),
+        sa.Column("progress", sa.Float(), nullable=False),
+        sa.Column("result", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column("error", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column("started_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("finished_at", sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["device_id"],
+            ["device.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_job_device_id"), "job", ["device_id"], unique=False)
+    op.create_index(
+        "ix_job_status_created_at", "job", ["status", "created_at"], unique=False
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_job_status_created_at", table_name="job")
+    op.drop_index(op.f("ix_job_device_id"), table_name="job")
+    op.drop_table("job")
+    sa.Enum(name="job_status_enum").drop(op.get_bind())
+    sa.Enum(name="job_kind_enum").drop(op.get_bind())
@@ -0,0 +1,121 @@
+"""partition sensor table by month
+
+Revision ID: 81220506f355
+Revises: 15881fa23ced
+Create Date: 2026-10-17 04:09:16.757532
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "81220506f355"
+down_revision: Union[str, Sequence[str], None] = "15881fa23ced"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+COLUMNS = "id, created_at, device_id, temperature, humidity, cpu_temperature"
+ROLLUP_TRIGGER = """
+    CREATE TRIGGER sensor_rollups
+    AFTER INSERT ON sensor
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION refresh_sensor_rollups()
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    _rename_sensor_table("sensor_unpartitioned")
+    op.execute(
+        """
+        CREATE TABLE sensor (
+            id uuid NOT NULL,
+            created_at timestamptz NOT NULL,
+            device_id uuid NOT NULL REFERENCES device (id),
+            temperature double precision,
+            humidity double precision,
+            cpu_temperature double precision,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+        """
+    )
+    op.execute(
+        "CREATE UNIQUE INDEX ix_sensor_device_id_created_at "
+        "ON sensor (device_id, created_at)"
+    )
+    op.execute(
+        "CREATE INDEX ix_sensor_created_at_brin ON sensor USING brin (created_at)"
+    )
+    op.execute(
+        """
+        CREATE FUNCTION create_sensor_partitions(
+            from_time timestamptz, to_time timestamptz
+        ) RETURNS void AS $$
+        DECLARE
+            month timestamp := date_trunc('month', from_time AT TIME ZONE 'UTC');
+        BEGIN
+            WHILE month <= to_time AT TIME ZONE 'UTC' LOOP
+                EXECUTE format(
+                    'CREATE TABLE IF NOT EXISTS %I PARTITION OF sensor '
+                    'FOR VALUES FROM (%L) TO (%L)',
+                    'sensor_' || to_char(month, 'YYYY_MM'),
+                    month AT TIME ZONE 'UTC',
+                    (month + interval '1 month') AT TIME ZONE 'UTC'
+                );
+                month := month + interval '1 month';
+            END LOOP;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        "SELECT create_sensor_partitions("
+        "coalesce(min(created_at), now()), now() + interval '3 months'"
+        ") FROM sensor_unpartitioned"
+    )
+    op.execute(
+        f"INSERT INTO sensor ({COLUMNS}) SELECT {COLUMNS} FROM sensor_unpartitioned"
+    )
+    op.execute("DROP TABLE sensor_unpartitioned")
+    op.execute(ROLLUP_TRIGGER)
+
+
+def _rename_sensor_table(name: str) -> None:
+    op.execute("DROP TRIGGER sensor_rollups ON sensor")
+    op.execute(f"ALTER TABLE sensor RENAME TO {name}")
+    op.execute(f"ALTER TABLE {name} RENAME CONSTRAINT sensor_pkey TO {name}_pkey")
+    op.execute(
+        "ALTER INDEX ix_sensor_device_id_created_at "
+        f"RENAME TO ix_{name}_device_id_created_at"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    _rename_sensor_table("sensor_partitioned")
+    op.execute(
+        """
+        CREATE TABLE sensor (
+            id uuid NOT NULL PRIMARY KEY,
+            created_at timestamptz NOT NULL,
+            device_id uuid NOT NULL REFERENCES device (id),
+            temperature double precision,
+            humidity double precision,
+            cpu_temperature double precision
+        )
+        """
+    )
+    op.execute(
+        f"INSERT INTO sensor ({COLUMNS}) SELECT {COLUMNS} FROM sensor_partitioned"
+    )
+    op.execute("DROP TABLE sensor_partitioned")
+    op.execute("DROP FUNCTION create_sensor_partitions(timestamptz, timestamptz)")
+    op.execute(
+        "CREATE UNIQUE INDEX ix_sensor_device_id_created_at "
+        "ON sensor (device_id, created_at)"
+    )
+    op.execute(ROLLUP_TRIGGER)
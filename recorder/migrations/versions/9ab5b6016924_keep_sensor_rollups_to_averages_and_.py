@@ -0,0 +1,128 @@
+"""keep sensor rollups to averages and refresh on delete
+
+Revision ID: 9ab5b6016924
+Revises: ea69ce3003bd
+Create Date: 2026-10-17 06:17:51.153188
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "9ab5b6016924"
+down_revision: Union[str, Sequence[str], None] = "ea69ce3003bd"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+ROLLUPS = {"sensor_hourly": "hour", "sensor_daily": "day"}
+FIELDS = ("temperature", "humidity", "cpu_temperature")
+# Sensor rows are never updated, so inserts and deletes are the only changes
+# the rollups have to follow.
+DELETE_TRIGGER = """
+    CREATE TRIGGER sensor_rollups_delete
+    AFTER DELETE ON sensor
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION refresh_sensor_rollups_after_delete()
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table in ROLLUPS:
+        for field in FIELDS:
+            op.drop_column(table, f"{field}_min")
+            op.drop_column(table, f"{field}_max")
+    _create_refresh_function(("avg",))
+    inserts = ";".join(
+        _refresh_rollup_sql(t, u, "old_rows", ("avg",)) for t, u in ROLLUPS.items()
+    )
+    op.execute(
+        f"""
+        CREATE FUNCTION refresh_sensor_rollups_after_delete() RETURNS trigger AS $$
+        BEGIN
+            {";".join(_delete_buckets_sql(t, u) for t, u in ROLLUPS.items())};
+            {inserts};
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(DELETE_TRIGGER)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TRIGGER sensor_rollups_delete ON sensor")
+    op.execute("DROP FUNCTION refresh_sensor_rollups_after_delete()")
+    for table in ROLLUPS:
+        for field in FIELDS:
+            for aggregate in ("min", "max"):
+                op.add_column(
+                    table,
+                    sa.Column(f"{field}_{aggregate}", sa.Float(), nullable=True),
+                )
+    _create_refresh_function(("min", "max", "avg"))
+    for table, unit in ROLLUPS.items():
+        op.execute(_refresh_rollup_sql(table, unit, "sensor", ("min", "max", "avg")))
+
+
+def _create_refresh_function(aggregates: tuple[str, ...]) -> None:
+    inserts = ";".join(
+        _refresh_rollup_sql(t, u, "new_rows", aggregates) for t, u in ROLLUPS.items()
+    )
+    op.execute(
+        f"""
+        CREATE OR REPLACE FUNCTION refresh_sensor_rollups() RETURNS trigger AS $$
+        BEGIN
+            {inserts};
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+
+
+def _delete_buckets_sql(table: str, unit: str) -> str:
+    # Buckets left without any rows are not recomputed, so clear them first.
+    return f"""
+        DELETE FROM {table} r
+        USING (
+            SELECT DISTINCT device_id, date_trunc('{unit}', created_at, 'UTC') AS bucket
+            FROM old_rows
+        ) b
+        WHERE r.device_id = b.device_id AND r.bucket = b.bucket
+    """
+
+
+def _refresh_rollup_sql(
+    table: str, unit: str, source: str, aggregates: tuple[str, ...]
+) -> str:
+    values = ", ".join(
+        f"{aggregate}(s.{field})" for field in FIELDS for aggregate in aggregates
+    )
+    columns = ", ".join(
+        f"{field}_{aggregate}" for field in FIELDS for aggregate in aggregates
+    )
+    updates = ", ".join(
+        f"{column} = EXCLUDED.{column}" for column in ["count", *columns.split(", ")]
+    )
+    return f"""
+        INSERT INTO {table} (device_id, bucket, count, {columns})
+        SELECT s.device_id, b.bucket, count(*), {values}
+        FROM (
+            SELECT DISTINCT device_id, date_trunc('{unit}', created_at, 'UTC') AS bucket
+            FROM {source}
+        ) b
+        JOIN sensor s
+            ON s.device_id = b.device_id
+            AND s.created_at >= b.bucket
+            AND s.created_at < b.bucket + interval '1 {unit}'
+        WHERE s.temperature IS NULL OR s.temperature > -30
+        GROUP BY s.device_id, b.bucket
+        ON CONFLICT (device_id, bucket) DO UPDATE SET {updates}
+    """
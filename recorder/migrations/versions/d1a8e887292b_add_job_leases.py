@@ -0,0 +1,75 @@
+"""add job leases
+
+Revision ID: d1a8e887292b
+Revises: 1cd3320a1ebc
+Create Date: 2026-10-17 04:20:49.513826
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+# revision identifiers, used by Alembic.
+revision: str = "d1a8e887292b"
+down_revision: Union[str, Sequence[str], None] = "1cd3320a1ebc"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("ALTER TYPE job_kind_enum ADD VALUE IF NOT EXISTS 'timelapse'")
+    op.add_column(
+        "job",
+        sa.Column("worker_id", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    )
+    op.add_column(
+        "job",
+        sa.Column("lease_expires_at", sa.DateTime(timezone=True), nullable=True),
+    )
+    op.add_column(
+        "job",
+        sa.Column("attempts", sa.Integer(), server_default="0", nullable=False),
+    )
+    op.add_column(
+        "job",
+        sa.Column(
+            "cancel_requested", sa.Boolean(), server_default="false", nullable=False
+        ),
+    )
+    op.alter_column("job", "attempts", server_default=None)
+    op.alter_column("job", "cancel_requested", server_default=None)
+    op.execute(
+        "UPDATE job SET status = 'pending', progress = 0 WHERE status = 'running'"
+    )
+    op.create_index(
+        "ix_job_running_record_device_id",
+        "job",
+        ["device_id"],
+        unique=True,
+        postgresql_where=sa.text("status = 'running' AND kind = 'record'"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(
+        "ix_job_running_record_device_id",
+        table_name="job",
+        postgresql_where=sa.text("status = 'running' AND kind = 'record'"),
+    )
+    op.drop_column("job", "cancel_requested")
+    op.drop_column("job", "attempts")
+    op.drop_column("job", "lease_expires_at")
+    op.drop_column("job", "worker_id")
+    op.execute("DELETE FROM job WHERE kind = 'timelapse'")
+    op.execute("ALTER TYPE job_kind_enum RENAME TO job_kind_enum_old")
+    op.execute("CREATE TYPE job_kind_enum AS ENUM ('record')")
+    op.execute(
+        "ALTER TABLE job ALTER COLUMN kind TYPE job_kind_enum "
+        "USING kind::text::job_kind_enum"
+    )
+    op.execute("DROP TYPE job_kind_enum_old")
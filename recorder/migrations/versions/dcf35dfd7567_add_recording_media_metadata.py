@@ -0,0 +1,46 @@
+"""add recording media metadata
+
+Revision ID: dcf35dfd7567
+Revises: d1a8e887292b
+Create Date: 2026-10-17 04:27:48.471434
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+# revision identifiers, used by Alembic.
+revision: str = "dcf35dfd7567"
+down_revision: Union[str, Sequence[str], None] = "d1a8e887292b"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("recording", sa.Column("duration", sa.Float(), nullable=True))
+    op.add_column("recording", sa.Column("width", sa.Integer(), nullable=True))
+    op.add_column("recording", sa.Column("height", sa.Integer(), nullable=True))
+    op.add_column(
+        "recording",
+        sa.Column("codec", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    )
+    op.add_column("recording", sa.Column("bitrate", sa.BigInteger(), nullable=True))
+    op.add_column("recording", sa.Column("size", sa.BigInteger(), nullable=True))
+    op.add_column(
+        "recording", sa.Column("keyframe_interval", sa.Float(), nullable=True)
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("recording", "keyframe_interval")
+    op.drop_column("recording", "size")
+    op.drop_column("recording", "bitrate")
+    op.drop_column("recording", "codec")
+    op.drop_column("recording", "height")
+    op.drop_column("recording", "width")
+    op.drop_column("recording", "duration")
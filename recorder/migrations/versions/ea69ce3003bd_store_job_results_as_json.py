@@ -0,0 +1,43 @@
+"""store job results as json
+
+Revision ID: ea69ce3003bd
+Revises: dcf35dfd7567
+Create Date: 2026-10-17 05:43:45.362743
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+import sqlmodel
+
+# revision identifiers, used by Alembic.
+revision: str = "ea69ce3003bd"
+down_revision: Union[str, Sequence[str], None] = "dcf35dfd7567"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.alter_column(
+        "job",
+        "result",
+        type_=postgresql.JSONB(astext_type=sa.Text()),
+        postgresql_using=(
+            "CASE WHEN result IS NULL THEN NULL "
+            "ELSE jsonb_build_object('url', result) END"
+        ),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.alter_column(
+        "job",
+        "result",
+        type_=sqlmodel.sql.sqltypes.AutoString(),
+        postgresql_using="result ->> 'url'",
+    )
@@ -0,0 +1,80 @@
+"""add current device url
+
+Revision ID: fac2587bff03
+Revises: 81220506f355
+Create Date: 2026-10-17 04:10:03.342054
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = "fac2587bff03"
+down_revision: Union[str, Sequence[str], None] = "81220506f355"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+REGISTRATION_HISTORY_SIZE = 100
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "device",
+        sa.Column("url", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    )
+    op.execute(
+        """
+        UPDATE device
+        SET url = (
+            SELECT url FROM registration
+            WHERE registration.device_id = device.id
+            ORDER BY created_at DESC
+            LIMIT 1
+        )
+        """
+    )
+    op.execute(
+        """
+        DELETE FROM registration
+        WHERE id IN (
+            SELECT id FROM (
+                SELECT
+                    id,
+                    url,
+                    lag(url) OVER (
+                        PARTITION BY device_id ORDER BY created_at
+                    ) AS previous_url
+                FROM registration
+            ) heartbeats
+            WHERE url = previous_url
+        )
+        """
+    )
+    op.execute(
+        f"""
+        DELETE FROM registration
+        WHERE id IN (
+            SELECT id FROM (
+                SELECT
+                    id,
+                    row_number() OVER (
+                        PARTITION BY device_id ORDER BY created_at DESC
+                    ) AS n
+                FROM registration
+            ) history
+            WHERE n > {REGISTRATION_HISTORY_SIZE}
+        )
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("device", "url")
@@ -0,0 +1,68 @@
+import logging
+import sys
+from tempfile import TemporaryDirectory
+
+import click
+
+import src.db.models as models
+from src.record import RecordingMode, record_and_save
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+
+@click.command()
+@click.option("--device-url", required=True, help="Base URL of a streaming device.")
+@click.option("--duration", default=10, show_default=True)
+@click.option(
+    "--mode",
+    "modes",
+    type=click.Choice([m.value for m in RecordingMode]),
+    multiple=True,
+    help="Recording modes to check. All of them by default.",
+)
+@click.option(
+    "--recording-dir",
+    help="Where to save recordings, such as a gs:// bucket. A temporary "
+    "directory by default.",
+)
+def smoke(
+    device_url: str, duration: int, modes: tuple[str, ...], recording_dir: str | None
+) -> None:
+    """
+    Record from a device in each mode with the installed ffmpeg and check that
+    the result is a playable H.264 MP4 of about the requested duration. Point it
+    at a Pi running with TEST_STREAM=true to check the pipeline end to end.
+    """
+    device = models.Device(name="smoke", url=device_url)
+    failed = False
+    for mode in map(RecordingMode, modes or RecordingMode):
+        with TemporaryDirectory() as temp_dir:
+            url, media = record_and_save(
+                "http://localhost/",
+                device_url,
+                device,
+                recording_dir or temp_dir,
+                duration,
+                mode,
+            )
+        problem = None
+        if media is None:
+            problem = "could not be probed"
+        elif media.codec != "h264":
+            problem = f"has codec {media.codec}"
+        elif abs(media.duration - duration) > 1.0:
+            problem = f"is {media.duration:.1f}s long"
+        if problem:
+            failed = True
+            logging.error(f"{mode} recording {url} {problem}")
+        else:
+            logging.info(f"{mode} recording {url} is fine: {media}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    smoke()
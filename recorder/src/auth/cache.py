@@ -0,0 +1,43 @@
+from collections import OrderedDict
+import hashlib
+from threading import Lock
+import time
+
+from src.auth.types import DecodedToken
+
+
+class TokenCache:
+    def __init__(self, max_size: int = 1024, recheck_interval: float = 300.0) -> None:
+        self.max_size = max_size
+        self.recheck_interval = recheck_interval
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[DecodedToken, float]] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, token: str) -> DecodedToken | None:
+        key = _hash(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.time():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, token: str, decoded_token: DecodedToken) -> None:
+        expires_at = time.time() + self.recheck_interval
+        if decoded_token.exp is not None:
+            expires_at = min(expires_at, decoded_token.exp)
+        key = _hash(token)
+        with self._lock:
+            self._entries[key] = (decoded_token, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+def _hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
@@ -1,18 +1,26 @@
 from src.auth import firebase, google
+from src.auth.cache import TokenCache
 from src.auth.types import DecodedToken, TokenDecoder
 
 from typing import Callable
 
 
 class Decoder(TokenDecoder):
-    def __init__(self) -> None:
+    def __init__(self, cache: TokenCache | None = None) -> None:
         self.decoders: list[TokenDecoder] = [
             firebase.FirebaseDecoder(),
             google.GoogleDecoder(),
         ]
+        self.cache = cache
 
     def decode(self, token: str) -> DecodedToken:
-        return _decode_token(token, self.decoders)
+        if self.cache is None:
+            return _decode_token(token, self.decoders)
+        decoded_token = self.cache.get(token)
+        if decoded_token is None:
+            decoded_token = _decode_token(token, self.decoders)
+            self.cache.put(token, decoded_token)
+        return decoded_token
 
 
 def _decode_token(token: str, decoders: list[TokenDecoder]) -> DecodedToken:
@@ -26,4 +26,9 @@ def _decode(
     if decoded.get("iss") not in {"https://accounts.google.com", "accounts.google.com"}:
         raise ValueError("Wrong issuer")
 
-    return DecodedToken(uid=decoded["sub"], email=decoded["email"], provider="google")
+    return DecodedToken(
+        uid=decoded["sub"],
+        email=decoded["email"],
+        provider="google",
+        exp=decoded.get("exp"),
+    )
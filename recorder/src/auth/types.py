@@ -10,6 +10,7 @@ class DecodedToken:
     uid: UID
     email: Email
     provider: str
+    exp: float | None = None
 
 
 class TokenDecoder(Protocol):
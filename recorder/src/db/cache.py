@@ -0,0 +1,108 @@
+from dataclasses import dataclass
+import logging
+from threading import Event, Lock, Thread
+import time
+import uuid
+
+import psycopg
+from sqlalchemy import make_url
+
+import src.db.models as models
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedUser:
+    email: str | None
+    provider: str | None
+    role: models.Role | None
+    expires_at: float
+
+
+class UserCache:
+    def __init__(self, ttl: float = 60.0) -> None:
+        self.ttl = ttl
+        self._users: dict[str, CachedUser] = {}
+        self._lock = Lock()
+
+    def get(self, uid: str) -> CachedUser | None:
+        with self._lock:
+            user = self._users.get(uid)
+            if user is None or user.expires_at <= time.monotonic():
+                self._users.pop(uid, None)
+                return None
+            return user
+
+    def put(self, user: models.User) -> None:
+        with self._lock:
+            self._users[user.uid] = CachedUser(
+                email=user.email,
+                provider=user.provider,
+                role=user.role,
+                expires_at=time.monotonic() + self.ttl,
+            )
+
+    def invalidate(self, uid: str) -> None:
+        with self._lock:
+            self._users.pop(uid, None)
+
+
+@dataclass
+class CachedDevice:
+    id: uuid.UUID
+    allowed_roles: list[models.Role]
+    url: str | None
+    expires_at: float
+
+
+class DeviceCache:
+    def __init__(self, ttl: float = 30.0) -> None:
+        self.ttl = ttl
+        self._devices: dict[str, CachedDevice] = {}
+        self._lock = Lock()
+        self._stop_listening = Event()
+
+    def get(self, name: str) -> CachedDevice | None:
+        with self._lock:
+            device = self._devices.get(name)
+            if device is None or device.expires_at <= time.monotonic():
+                self._devices.pop(name, None)
+                return None
+            return device
+
+    def put(self, device: models.Device) -> CachedDevice:
+        cached_device = CachedDevice(
+            id=device.id,
+            allowed_roles=list(device.allowed_roles),
+            url=device.url,
+            expires_at=time.monotonic() + self.ttl,
+        )
+        with self._lock:
+            self._devices[device.name] = cached_device
+        return cached_device
+
+    def invalidate(self, name: str) -> None:
+        with self._lock:
+            self._devices.pop(name, None)
+
+    def listen(self, database_url: str, channel: str) -> None:
+        Thread(target=self._listen, args=(database_url, channel), daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop_listening.set()
+
+    def _listen(self, database_url: str, channel: str) -> None:
+        conninfo = make_url(database_url).set(drivername="postgresql")
+        while not self._stop_listening.is_set():
+            try:
+                with psycopg.connect(
+                    conninfo.render_as_string(hide_password=False), autocommit=True
+                ) as connection:
+                    connection.execute(f"LISTEN {channel}")
+                    while not self._stop_listening.is_set():
+                        for notify in connection.notifies(timeout=1.0):
+                            self.invalidate(notify.payload)
+            except psycopg.Error:
+                logger.exception(f"Lost connection while listening on {channel}")
+                self._stop_listening.wait(5.0)
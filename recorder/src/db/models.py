@@ -2,7 +2,8 @@ import enum
 import uuid
 from datetime import datetime, timezone
 from sqlmodel import ARRAY, Enum, SQLModel, Field
-from sqlalchemy import Column, DateTime
+from sqlalchemy import BigInteger, Column, DateTime, Index, text
+from sqlalchemy.dialects.postgresql import JSONB
 
 
 class Role(enum.StrEnum):
@@ -36,6 +37,7 @@ class User(SQLModel, table=True):
 class Device(SQLModel, table=True):
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     name: str = Field(index=True, unique=True)
+    url: str | None = None
     allowed_roles: list[Role] = Field(
         sa_column=Column(
             ARRAY(role_enum),
@@ -46,10 +48,16 @@ class Device(SQLModel, table=True):
 
 
 class Sensor(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_sensor_device_id_created_at", "device_id", "created_at", unique=True),
+        Index("ix_sensor_created_at_brin", "created_at", postgresql_using="brin"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     created_at: datetime = Field(
         default_factory=lambda: datetime.now(timezone.utc),
-        sa_column=Column(DateTime(timezone=True), nullable=False),
+        sa_column=Column(DateTime(timezone=True), primary_key=True, nullable=False),
     )
     device_id: uuid.UUID = Field(foreign_key="device.id")
     temperature: float | None
@@ -57,6 +65,23 @@ class Sensor(SQLModel, table=True):
     cpu_temperature: float | None
 
 
+class SensorRollup(SQLModel):
+    device_id: uuid.UUID = Field(foreign_key="device.id", primary_key=True)
+    bucket: datetime = Field(sa_type=DateTime(timezone=True), primary_key=True)  # type: ignore
+    count: int
+    temperature_avg: float | None
+    humidity_avg: float | None
+    cpu_temperature_avg: float | None
+
+
+class SensorHourly(SensorRollup, table=True):
+    __tablename__ = "sensor_hourly"  # type: ignore
+
+
+class SensorDaily(SensorRollup, table=True):
+    __tablename__ = "sensor_daily"  # type: ignore
+
+
 class Recording(SQLModel, table=True):
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     created_at: datetime = Field(
@@ -65,6 +90,13 @@ class Recording(SQLModel, table=True):
     )
     device_id: uuid.UUID = Field(foreign_key="device.id")
     url: str
+    duration: float | None = None
+    width: int | None = None
+    height: int | None = None
+    codec: str | None = None
+    bitrate: int | None = Field(default=None, sa_type=BigInteger)  # type: ignore
+    size: int | None = Field(default=None, sa_type=BigInteger)  # type: ignore
+    keyframe_interval: float | None = None
 
 
 class Registration(SQLModel, table=True):
@@ -75,3 +107,74 @@ class Registration(SQLModel, table=True):
     )
     device_id: uuid.UUID = Field(foreign_key="device.id", index=True)
     url: str
+
+
+class JobKind(enum.StrEnum):
+    RECORD = "record"
+    TIMELAPSE = "timelapse"
+
+
+class JobStatus(enum.StrEnum):
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+job_kind_enum = Enum(
+    JobKind,
+    name="job_kind_enum",
+    create_constraint=True,
+    values_callable=lambda enum_cls: [e.value for e in enum_cls],
+)
+
+job_status_enum = Enum(
+    JobStatus,
+    name="job_status_enum",
+    create_constraint=True,
+    values_callable=lambda enum_cls: [e.value for e in enum_cls],
+)
+
+
+class Job(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_job_status_created_at", "status", "created_at"),
+        Index(
+            "ix_job_running_record_device_id",
+            "device_id",
+            unique=True,
+            postgresql_where=text("status = 'running' AND kind = 'record'"),
+        ),
+    )
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(timezone.utc),
+        sa_column=Column(DateTime(timezone=True), nullable=False),
+    )
+    kind: JobKind = Field(sa_column=Column(job_kind_enum, nullable=False))
+    status: JobStatus = Field(
+        default=JobStatus.PENDING,
+        sa_column=Column(job_status_enum, nullable=False),
+    )
+    device_id: uuid.UUID = Field(foreign_key="device.id", index=True)
+    params: dict = Field(
+        default_factory=dict,
+        sa_column=Column(JSONB, nullable=False, server_default="{}"),
+    )
+    progress: float = 0.0
+    result: dict | None = Field(default=None, sa_column=Column(JSONB, nullable=True))
+    error: str | None = None
+    started_at: datetime | None = Field(
+        default=None, sa_column=Column(DateTime(timezone=True), nullable=True)
+    )
+    finished_at: datetime | None = Field(
+        default=None, sa_column=Column(DateTime(timezone=True), nullable=True)
+    )
+    worker_id: str | None = None
+    lease_expires_at: datetime | None = Field(
+        default=None, sa_column=Column(DateTime(timezone=True), nullable=True)
+    )
+    attempts: int = 0
+    cancel_requested: bool = False
@@ -1,67 +1,114 @@
-from datetime import datetime
-from uuid import UUID
-from sqlmodel import Session, select
+from dataclasses import asdict
+from datetime import datetime, timedelta
+from typing import Iterable
+from uuid import UUID, uuid4
+from sqlalchemy import func, or_, text
+from sqlalchemy.orm import aliased
+from sqlmodel import col, delete, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 import src.db.models as models
+from src.media import MediaInfo
 
 
-def session_is_alive(session: Session) -> bool:
+async def session_is_alive(session: AsyncSession) -> bool:
     try:
-        session.exec(select(1)).first()
+        (await session.exec(select(1))).first()
         return True
     except Exception:
         return False
 
 
-def get_device(
-    session: Session, name: str, role: models.Role | None = None
+async def get_device(
+    session: AsyncSession, name: str, role: models.Role | None = None
 ) -> models.Device | None:
     statement = select(models.Device).where(models.Device.name == name)
     if role:
         statement = statement.where(models.Device.allowed_roles.any(role))  # type: ignore
-    return session.exec(statement).first()
+    return (await session.exec(statement)).first()
 
 
-def get_devices(session: Session, role: models.Role) -> list[models.Device]:
+async def get_device_by_id(session: AsyncSession, id: UUID) -> models.Device | None:
+    statement = select(models.Device).where(models.Device.id == id)
+    return (await session.exec(statement)).first()
+
+
+async def get_devices(session: AsyncSession, role: models.Role) -> list[models.Device]:
     statement = select(models.Device).where(models.Device.allowed_roles.any(role))  # type: ignore
-    return list(session.exec(statement).all())
+    return list((await session.exec(statement)).all())
+
+
+async def get_devices_with_urls(
+    session: AsyncSession, role: models.Role | None = None, name: str | None = None
+) -> list[tuple[models.Device, str | None]]:
+    statement = select(models.Device)
+    if role:
+        statement = statement.where(models.Device.allowed_roles.any(role))  # type: ignore
+    if name:
+        statement = statement.where(models.Device.name == name)
+    return [(device, device.url) for device in (await session.exec(statement)).all()]
 
 
-def add_device(session: Session, name: str) -> models.Device:
+async def add_device(session: AsyncSession, name: str) -> models.Device:
     device = models.Device(name=name, allowed_roles=[models.Role.ADMIN])
     session.add(device)
-    session.commit()
-    session.refresh(device)
+    await session.commit()
+    await session.refresh(device)
     return device
 
 
-def set_device_roles(session: Session, device: models.Device, roles: list[models.Role]):
+async def set_device_roles(
+    session: AsyncSession, device: models.Device, roles: list[models.Role]
+):
     device.allowed_roles = roles
     session.add(device)
-    session.commit()
-    session.refresh(device)
+    await session.commit()
+    await session.refresh(device)
 
 
-def register_device(session: Session, device: models.Device, url: str):
-    register = models.Registration(device_id=device.id, url=url)
-    session.add(register)
-    session.commit()
-    session.refresh(register)
+REGISTRATION_HISTORY_SIZE = 100
 
 
-def get_url(session: Session, name: str) -> str | None:
-    statement = (
-        select(models.Registration)
-        .join(models.Device)
-        .where(models.Device.name == name)
+async def register_device(
+    session: AsyncSession, device: models.Device, url: str
+) -> bool:
+    if device.url == url:
+        return False
+    device.url = url
+    session.add(device)
+    session.add(models.Registration(device_id=device.id, url=url))
+    await session.flush()
+    stale_registrations = (
+        select(models.Registration.id)
+        .where(models.Registration.device_id == device.id)
         .order_by(models.Registration.created_at.desc())  # type: ignore
+        .offset(REGISTRATION_HISTORY_SIZE)
     )
-    register = session.exec(statement).first()
-    return register.url if register else None
+    await session.exec(
+        delete(models.Registration).where(
+            col(models.Registration.id).in_(stale_registrations)
+        )
+    )
+    await session.commit()
+    await session.refresh(device)
+    return True
+
+
+async def notify_device_changed(session: AsyncSession, channel: str, name: str) -> None:
+    await session.exec(
+        text("SELECT pg_notify(:channel, :name)"),
+        params={"channel": channel, "name": name},
+    )
+    await session.commit()
+
 
+async def get_url(session: AsyncSession, name: str) -> str | None:
+    statement = select(models.Device.url).where(models.Device.name == name)
+    return (await session.exec(statement)).first()
 
-def get_recordings(
-    session: Session,
+
+async def get_recordings(
+    session: AsyncSession,
     device_name: str,
     start: datetime | None = None,
     end: datetime | None = None,
@@ -75,16 +122,76 @@ def get_recordings(
         statement = statement.where(models.Recording.created_at >= start)
     if end:
         statement = statement.where(models.Recording.created_at <= end)
-    return list(session.exec(statement).all())
+    return list((await session.exec(statement)).all())
+
+
+async def add_recording(
+    session: AsyncSession,
+    device: models.Device,
+    url: str,
+    media: MediaInfo | None = None,
+) -> models.Recording:
+    recording = models.Recording(
+        device_id=device.id, url=url, **(asdict(media) if media else {})
+    )
+    session.add(recording)
+    await session.commit()
+    await session.refresh(recording)
+    return recording
+
+
+async def get_recordings_without_media(
+    session: AsyncSession, after: UUID | None, limit: int
+) -> list[models.Recording]:
+    statement = (
+        select(models.Recording)
+        .where(col(models.Recording.duration).is_(None))
+        .order_by(models.Recording.id)  # type: ignore
+        .limit(limit)
+    )
+    if after:
+        statement = statement.where(models.Recording.id > after)
+    return list((await session.exec(statement)).all())
+
+
+async def set_recording_media(
+    session: AsyncSession, media: Iterable[tuple[UUID, MediaInfo]]
+) -> None:
+    rows = [{"id": id, **asdict(m)} for id, m in media]
+    if not rows:
+        return
+    await session.exec(update(models.Recording), params=rows)  # type: ignore
+    await session.commit()
+
 
+HOURLY_ROLLUP_MIN_RANGE = timedelta(days=7)
+DAILY_ROLLUP_MIN_RANGE = timedelta(days=180)
 
-def get_sensors(
-    session: Session,
+
+async def get_sensors(
+    session: AsyncSession,
     role: models.Role,
     device_name: str,
     start: datetime | None = None,
     end: datetime | None = None,
 ) -> list[models.Sensor]:
+    if start:
+        # An open-ended range runs up to now.
+        range_end = end or datetime.now(start.tzinfo)
+        if range_end - start >= DAILY_ROLLUP_MIN_RANGE:
+            return await _get_sensor_rollups(
+                session, models.SensorDaily, "day", role, device_name, start, range_end
+            )
+        if range_end - start >= HOURLY_ROLLUP_MIN_RANGE:
+            return await _get_sensor_rollups(
+                session,
+                models.SensorHourly,
+                "hour",
+                role,
+                device_name,
+                start,
+                range_end,
+            )
     statement = (
         select(models.Sensor)
         .join(models.Device)
@@ -97,11 +204,42 @@ def get_sensors(
         statement = statement.where(models.Sensor.created_at >= start)
     if end:
         statement = statement.where(models.Sensor.created_at <= end)
-    return list(session.exec(statement).all())
+    return list((await session.exec(statement)).all())
 
 
-def add_sensor(
-    session: Session,
+async def _get_sensor_rollups(
+    session: AsyncSession,
+    rollup: type[models.SensorHourly] | type[models.SensorDaily],
+    unit: str,
+    role: models.Role,
+    device_name: str,
+    start: datetime,
+    end: datetime,
+) -> list[models.Sensor]:
+    statement = (
+        select(rollup)
+        .join(models.Device)
+        .order_by(rollup.bucket.desc())  # type: ignore
+        .where(models.Device.name == device_name)
+        .where(models.Device.allowed_roles.any(role))  # type: ignore
+        # The bucket holding start covers the first part of the range too.
+        .where(rollup.bucket >= func.date_trunc(unit, start, "UTC"))
+        .where(rollup.bucket <= end)
+    )
+    return [
+        models.Sensor(
+            created_at=r.bucket,
+            device_id=r.device_id,
+            temperature=r.temperature_avg,
+            humidity=r.humidity_avg,
+            cpu_temperature=r.cpu_temperature_avg,
+        )
+        for r in (await session.exec(statement)).all()
+    ]
+
+
+async def add_sensor(
+    session: AsyncSession,
     device: models.Device,
     temperature: float | None,
     humidity: float | None,
@@ -114,28 +252,233 @@ def add_sensor(
         cpu_temperature=cpu_temperature,
     )
     session.add(sensor)
-    session.commit()
-    session.refresh(sensor)
+    await session.commit()
+    await session.refresh(sensor)
     return sensor
 
 
-def get_user_by_uid(session: Session, uid: str) -> models.User | None:
+async def add_sensors(session: AsyncSession, sensors: list[models.Sensor]) -> None:
+    if not sensors:
+        return
+    session.add_all(sensors)
+    await session.commit()
+
+
+async def get_device_ids(
+    session: AsyncSession, names: Iterable[str]
+) -> dict[str, UUID]:
+    statement = select(models.Device.name, models.Device.id).where(
+        col(models.Device.name).in_(set(names))
+    )
+    return {name: id for name, id in (await session.exec(statement)).all()}
+
+
+SensorRow = tuple[UUID, datetime, float | None, float | None, float | None]
+
+
+async def copy_sensors(session: AsyncSession, rows: Iterable[SensorRow]) -> int:
+    connection = await (await session.connection()).get_raw_connection()
+    driver_connection = connection.driver_connection
+    assert driver_connection is not None
+    async with driver_connection.cursor() as cursor:
+        await cursor.execute(
+            "CREATE TEMP TABLE sensor_staging (LIKE sensor INCLUDING DEFAULTS) "
+            "ON COMMIT DROP"
+        )
+        async with cursor.copy(
+            "COPY sensor_staging "
+            "(id, device_id, created_at, temperature, humidity, cpu_temperature) "
+            "FROM STDIN"
+        ) as copy:
+            for row in rows:
+                await copy.write_row((uuid4(), *row))
+        await cursor.execute(
+            "SELECT create_sensor_partitions(min(created_at), max(created_at)) "
+            "FROM sensor_staging"
+        )
+        await cursor.execute(
+            "INSERT INTO sensor "
+            "(id, device_id, created_at, temperature, humidity, cpu_temperature) "
+            "SELECT id, device_id, created_at, temperature, humidity, cpu_temperature "
+            "FROM sensor_staging "
+            "ON CONFLICT (device_id, created_at) DO NOTHING"
+        )
+        inserted = cursor.rowcount
+    await session.commit()
+    return inserted
+
+
+async def create_sensor_partitions(session: AsyncSession, months_ahead: int) -> None:
+    await session.exec(
+        text(
+            "SELECT create_sensor_partitions("
+            "now(), now() + make_interval(months => :months_ahead))"
+        ),
+        params={"months_ahead": months_ahead},
+    )
+    await session.commit()
+
+
+async def add_jobs(session: AsyncSession, jobs: list[models.Job]) -> list[models.Job]:
+    session.add_all(jobs)
+    await session.commit()
+    return jobs
+
+
+async def get_job(
+    session: AsyncSession, id: UUID, role: models.Role | None = None
+) -> models.Job | None:
+    statement = select(models.Job).where(models.Job.id == id)
+    if role:
+        statement = statement.join(models.Device).where(
+            models.Device.allowed_roles.any(role)  # type: ignore
+        )
+    return (await session.exec(statement)).first()
+
+
+async def claim_job(
+    session: AsyncSession, worker_id: str, lease: timedelta
+) -> models.Job | None:
+    running = aliased(models.Job)
+    device_busy = (
+        select(running.id)
+        .where(running.device_id == models.Job.device_id)
+        .where(running.status == models.JobStatus.RUNNING)
+        .where(running.kind == models.JobKind.RECORD)
+        .exists()
+    )
+    candidate = (
+        select(models.Job.id)
+        .where(models.Job.status == models.JobStatus.PENDING)
+        .where(or_(models.Job.kind != models.JobKind.RECORD, ~device_busy))
+        .order_by(models.Job.created_at)  # type: ignore
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    job = (
+        await session.exec(
+            update(models.Job)
+            .where(col(models.Job.id) == candidate)
+            .values(
+                status=models.JobStatus.RUNNING,
+                worker_id=worker_id,
+                lease_expires_at=func.now() + lease,
+                started_at=func.now(),
+                attempts=models.Job.attempts + 1,
+            )
+            .returning(models.Job)
+        )
+    ).scalar()
+    await session.commit()
+    return job
+
+
+async def renew_job_lease(
+    session: AsyncSession,
+    id: UUID,
+    worker_id: str,
+    lease: timedelta,
+    progress: float,
+) -> bool | None:
+    cancel_requested = (
+        await session.exec(
+            update(models.Job)
+            .where(col(models.Job.id) == id)
+            .where(col(models.Job.worker_id) == worker_id)
+            .where(col(models.Job.status) == models.JobStatus.RUNNING)
+            .values(lease_expires_at=func.now() + lease, progress=progress)
+            .returning(models.Job.cancel_requested)
+        )
+    ).scalar()
+    await session.commit()
+    return cancel_requested
+
+
+async def expire_job_leases(session: AsyncSession, max_attempts: int) -> int:
+    expired = (
+        update(models.Job)
+        .where(col(models.Job.status) == models.JobStatus.RUNNING)
+        .where(col(models.Job.lease_expires_at) < func.now())
+    )
+    failed = await session.exec(
+        expired.where(col(models.Job.attempts) >= max_attempts).values(
+            status=models.JobStatus.FAILED,
+            error="Lease expired too many times",
+            worker_id=None,
+            lease_expires_at=None,
+            finished_at=func.now(),
+        )
+    )
+    requeued = await session.exec(
+        expired.values(
+            status=models.JobStatus.PENDING,
+            worker_id=None,
+            lease_expires_at=None,
+            progress=0.0,
+        )
+    )
+    await session.commit()
+    return failed.rowcount + requeued.rowcount
+
+
+async def finish_job(
+    session: AsyncSession,
+    id: UUID,
+    worker_id: str,
+    status: models.JobStatus,
+    result: dict | None = None,
+    error: str | None = None,
+) -> bool:
+    values: dict = {"status": status, "result": result, "error": error}
+    if status == models.JobStatus.SUCCEEDED:
+        values["progress"] = 1.0
+    finished = await session.exec(
+        update(models.Job)
+        .where(col(models.Job.id) == id)
+        .where(col(models.Job.worker_id) == worker_id)
+        .where(col(models.Job.status) == models.JobStatus.RUNNING)
+        .values(finished_at=func.now(), lease_expires_at=None, **values)
+    )
+    await session.commit()
+    return finished.rowcount > 0
+
+
+async def cancel_job(session: AsyncSession, id: UUID) -> bool:
+    cancelled = await session.exec(
+        update(models.Job)
+        .where(col(models.Job.id) == id)
+        .where(col(models.Job.status) == models.JobStatus.PENDING)
+        .values(status=models.JobStatus.CANCELLED, finished_at=func.now())
+    )
+    if not cancelled.rowcount:
+        cancelled = await session.exec(
+            update(models.Job)
+            .where(col(models.Job.id) == id)
+            .where(col(models.Job.status) == models.JobStatus.RUNNING)
+            .values(cancel_requested=True)
+        )
+    await session.commit()
+    return cancelled.rowcount > 0
+
+
+async def get_user_by_uid(session: AsyncSession, uid: str) -> models.User | None:
     statement = select(models.User).where(models.User.uid == uid)
-    return session.exec(statement).first()
+    return (await session.exec(statement)).first()
 
 
-def get_user_by_id(session: Session, id: UUID) -> models.User | None:
+async def get_user_by_id(session: AsyncSession, id: UUID) -> models.User | None:
     statement = select(models.User).where(models.User.id == id)
-    return session.exec(statement).first()
+    return (await session.exec(statement)).first()
 
 
-def add_user(session: Session, user: models.User) -> models.User:
+async def add_user(session: AsyncSession, user: models.User) -> models.User:
     session.add(user)
-    session.commit()
-    session.refresh(user)
+    await session.commit()
+    await session.refresh(user)
     return user
 
 
-def get_users(session: Session) -> list[models.User]:
+async def get_users(session: AsyncSession) -> list[models.User]:
     statement = select(models.User)
-    return list(session.exec(statement).all())
+    return list((await session.exec(statement)).all())
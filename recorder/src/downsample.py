@@ -0,0 +1,57 @@
+import numpy as np
+
+import src.db.models as models
+
+SENSOR_FIELDS = ("temperature", "humidity", "cpu_temperature")
+
+
+def downsample_sensors(
+    sensors: list[models.Sensor], max_points: int
+) -> list[models.Sensor]:
+    if len(sensors) <= max_points:
+        return sensors
+    x = np.array([s.created_at.timestamp() for s in sensors])
+    y = np.array(
+        [[getattr(s, field) for field in SENSOR_FIELDS] for s in sensors], dtype=float
+    )
+    return [sensors[i] for i in lttb(x, y, max_points)]
+
+
+def lttb(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Largest-triangle-three-buckets downsampling, returning the indices to keep.
+
+    y may hold one series per column. All series share the same buckets and
+    each bucket keeps the point with the largest triangle area summed over the
+    series, each scaled by its range and skipping missing values.
+    """
+    n = len(x)
+    if n <= max_points:
+        return np.arange(n)
+    if max_points < 3:
+        return np.array([0, n - 1][:max_points], dtype=int)
+    y = y.reshape(n, -1)
+    y = y[:, ~np.isnan(y).all(axis=0)]
+    span = np.nanmax(y, axis=0) - np.nanmin(y, axis=0)
+    y = y / np.where(span > 0, span, 1.0)
+    edges = np.linspace(1, n - 1, max_points - 1).astype(int)
+    next_edges = np.append(edges[2:], n)
+    selected = np.empty(max_points, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        next_x = x[end : next_edges[i]].mean()
+        next_y = _nanmean(y[end : next_edges[i]])
+        area = np.abs(
+            (x[a] - next_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end, None]) * (next_y - y[a])
+        )
+        a = start + int(np.argmax(np.nansum(area, axis=1)))
+        selected[i + 1] = a
+    return selected
+
+
+def _nanmean(y: np.ndarray) -> np.ndarray:
+    with np.errstate(invalid="ignore"):
+        return np.nansum(y, axis=0) / (~np.isnan(y)).sum(axis=0)
@@ -1,19 +1,85 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
 import logging
+import mimetypes
+import os
+from typing import BinaryIO
+from uuid import uuid4
 
+from google.api_core.exceptions import NotFound
 from google.cloud import storage
 
+PROJECT = "birdhouse-464804"
+# Resumable upload chunks must be a multiple of 256 KiB.
+CHUNK_SIZE = 32 * 256 * 1024
+COMPOSITE_UPLOAD_THRESHOLD = 128 * 1024 * 1024
+COMPOSITE_UPLOAD_MAX_PARTS = 32
+COMPOSITE_UPLOAD_MIN_PART_SIZE = 32 * 1024 * 1024
+COMPOSITE_UPLOAD_CONCURRENCY = 8
+
+
+@cache
+def get_client() -> storage.Client:
+    return storage.Client(project=PROJECT)
+
 
 def upload_to_gcs(source: str, gcs_path: str) -> str:
-    bucket_name, dest = _get_bucket_and_blob_name(gcs_path)
-    logging.info(f"Uploading {source} to {dest} in {bucket_name}.")
-    client = storage.Client(project="birdhouse-464804")
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(dest)
-    blob.upload_from_filename(source)
-    logging.info(f"File {source} uploaded to {dest} in {bucket_name}.")
+    blob = _get_blob(gcs_path)
+    size = os.path.getsize(source)
+    logging.info(f"Uploading {source} to {blob.name} in {blob.bucket.name}.")
+    if size >= COMPOSITE_UPLOAD_THRESHOLD:
+        _upload_composite(source, size, blob)
+    else:
+        blob.upload_from_filename(source)
+    logging.info(f"File {source} uploaded to {blob.name} in {blob.bucket.name}.")
     return blob.public_url
 
 
+def open_gcs_writer(gcs_path: str, content_type: str) -> BinaryIO:
+    """
+    Open a resumable upload to gcs_path. The upload is finalized when the writer
+    is closed and abandoned if its context exits with an exception.
+    """
+    return _get_blob(gcs_path).open(
+        "wb", chunk_size=CHUNK_SIZE, content_type=content_type, ignore_flush=True
+    )
+
+
+def get_public_url(gcs_path: str) -> str:
+    return _get_blob(gcs_path).public_url
+
+
+def _get_blob(gcs_path: str) -> storage.Blob:
+    bucket_name, blob_name = _get_bucket_and_blob_name(gcs_path)
+    return get_client().bucket(bucket_name).blob(blob_name)
+
+
+def _upload_composite(source: str, size: int, blob: storage.Blob) -> None:
+    part_count = min(
+        COMPOSITE_UPLOAD_MAX_PARTS, -(-size // COMPOSITE_UPLOAD_MIN_PART_SIZE)
+    )
+    part_size = -(-size // part_count)
+    prefix = f"{blob.name}.parts/{uuid4().hex}"
+    parts = [blob.bucket.blob(f"{prefix}/{i:02d}") for i in range(part_count)]
+
+    def upload_part(i: int) -> None:
+        with open(source, "rb") as f:
+            f.seek(i * part_size)
+            parts[i].upload_from_file(f, size=min(part_size, size - i * part_size))
+
+    try:
+        with ThreadPoolExecutor(max_workers=COMPOSITE_UPLOAD_CONCURRENCY) as executor:
+            list(executor.map(upload_part, range(part_count)))
+        blob.content_type = mimetypes.guess_type(blob.name)[0]
+        blob.compose(parts)
+    finally:
+        for part in parts:
+            try:
+                part.delete()
+            except NotFound:
+                pass
+
+
 def _get_bucket_and_blob_name(gcs_path: str) -> tuple[str, str]:
     *_, bucket_name, blob_name = gcs_path.split("/", maxsplit=3)
     return bucket_name, blob_name
@@ -0,0 +1,154 @@
+import asyncio
+from datetime import timedelta
+import logging
+import os
+import socket
+from threading import Event
+from typing import Awaitable, Callable
+from uuid import UUID, uuid4
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import src.db.models as models
+import src.db.queries as queries
+
+logger = logging.getLogger(__name__)
+
+
+class JobContext:
+    def __init__(self) -> None:
+        self.progress = 0.0
+        self.cancelled = Event()
+
+    def set_progress(self, progress: float) -> None:
+        self.progress = progress
+
+
+JobHandler = Callable[[models.Job, JobContext], Awaitable[dict | None]]
+
+
+class JobRunner:
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        handlers: dict[models.JobKind, JobHandler],
+        workers: int = 1,
+        lease_duration: float = 60.0,
+        heartbeat_interval: float = 10.0,
+        poll_interval: float = 5.0,
+        max_attempts: int = 3,
+    ) -> None:
+        self.engine = engine
+        self.handlers = handlers
+        self.workers = workers
+        self.lease = timedelta(seconds=lease_duration)
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid4().hex[:8]}"
+        self._wakeup = asyncio.Event()
+        self._running: dict[UUID, JobContext] = {}
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._expire_leases())]
+        self._tasks += [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for context in self._running.values():
+            context.cancelled.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self) -> None:
+        self._wakeup.set()
+
+    async def cancel(self, job_id: UUID) -> bool:
+        if context := self._running.get(job_id):
+            context.cancelled.set()
+        async with AsyncSession(self.engine, expire_on_commit=False) as session:
+            return await queries.cancel_job(session, job_id)
+
+    async def _work(self) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                async with AsyncSession(self.engine, expire_on_commit=False) as session:
+                    job = await queries.claim_job(session, self.worker_id, self.lease)
+            except IntegrityError:
+                # Another instance claimed a job for the same device concurrently.
+                continue
+            except Exception:
+                logger.exception("Failed to claim job")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run(job)
+            except Exception:
+                logger.exception(f"Failed to run job {job.id}")
+
+    async def _run(self, job: models.Job) -> None:
+        logger.info(f"Running {job.kind} job {job.id} on {self.worker_id}")
+        context = JobContext()
+        self._running[job.id] = context
+        heartbeat = asyncio.create_task(self._heartbeat(job.id, context))
+        try:
+            result = await self.handlers[job.kind](job, context)
+        except Exception as e:
+            if context.cancelled.is_set():
+                status, result, error = models.JobStatus.CANCELLED, None, None
+            else:
+                logger.exception(f"Job {job.id} failed")
+                status, result, error = models.JobStatus.FAILED, None, str(e)
+        else:
+            status, error = models.JobStatus.SUCCEEDED, None
+        finally:
+            heartbeat.cancel()
+            del self._running[job.id]
+        async with AsyncSession(self.engine, expire_on_commit=False) as session:
+            if await queries.finish_job(
+                session, job.id, self.worker_id, status, result, error
+            ):
+                logger.info(f"Job {job.id} {status}")
+            else:
+                logger.warning(f"Lost lease on job {job.id} before it finished")
+        self.notify()
+
+    async def _heartbeat(self, job_id: UUID, context: JobContext) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                async with AsyncSession(self.engine, expire_on_commit=False) as session:
+                    cancel_requested = await queries.renew_job_lease(
+                        session, job_id, self.worker_id, self.lease, context.progress
+                    )
+            except Exception:
+                logger.exception(f"Failed to renew lease on job {job_id}")
+                continue
+            if cancel_requested is None:
+                logger.warning(f"Lost lease on job {job_id}, stopping it")
+            if cancel_requested is not False:
+                context.cancelled.set()
+
+    async def _expire_leases(self) -> None:
+        while True:
+            try:
+                async with AsyncSession(self.engine, expire_on_commit=False) as session:
+                    expired = await queries.expire_job_leases(
+                        session, self.max_attempts
+                    )
+                if expired:
+                    logger.info(f"Released {expired} jobs with expired leases")
+                    self.notify()
+            except Exception:
+                logger.exception("Failed to expire job leases")
+            await asyncio.sleep(self.lease.total_seconds() / 2)
@@ -0,0 +1,147 @@
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import logging
+import time
+from typing import Awaitable, Callable
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DeviceStatus:
+    url: str
+    active: bool = False
+    last_seen: datetime | None = None
+    latency: float | None = None
+    consecutive_failures: int = 0
+    next_probe: float = 0.0
+
+
+class LivenessMonitor:
+    """
+    Probes every registered device in the background so requests can read
+    liveness without waiting on the devices. The loop only makes progress while
+    the instance has CPU, so on Cloud Run the service needs CPU always allocated
+    (--no-cpu-throttling); otherwise statuses go stale between requests.
+    """
+
+    def __init__(
+        self,
+        get_urls: Callable[[], Awaitable[dict[str, str]]],
+        interval: float = 30.0,
+        timeout: float = 5.0,
+        failure_threshold: int = 3,
+        max_backoff: float = 600.0,
+    ) -> None:
+        self.get_urls = get_urls
+        self.interval = interval
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.max_backoff = max_backoff
+        self.statuses: dict[str, DeviceStatus] = {}
+        self._client = httpx.AsyncClient(timeout=self.timeout)
+        self._inline_probes: dict[tuple[str, str], asyncio.Future[DeviceStatus]] = {}
+        # Devices probed inline since the last cycle read the registered URLs,
+        # which that cycle must not drop as unregistered.
+        self._probed_inline: set[str] = set()
+        self._task: asyncio.Task | None = None
+
+    async def is_active(self, name: str, url: str) -> bool:
+        """
+        Whether the device is active, probing it inline if it was registered
+        (or moved) after the last probe cycle. Concurrent requests for the same
+        device share one probe.
+        """
+        status = self.statuses.get(name)
+        if status is None or status.url != url:
+            key = (name, url)
+            probe = self._inline_probes.get(key)
+            if probe is None:
+                probe = asyncio.ensure_future(self._probe_inline(name, url))
+                self._inline_probes[key] = probe
+                probe.add_done_callback(lambda _: self._inline_probes.pop(key, None))
+            status = await asyncio.shield(probe)
+        return status.active
+
+    async def start(self) -> None:
+        """Run one probe cycle, then keep probing in the background."""
+        await self._probe_cycle()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._client.aclose()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self._probe_cycle()
+
+    async def _probe_cycle(self) -> None:
+        try:
+            urls = await self.get_urls()
+            await self.probe(self._client, urls)
+        except Exception:
+            logger.exception("Liveness probe cycle failed")
+
+    async def probe(self, client: httpx.AsyncClient, urls: dict[str, str]) -> None:
+        # Updated in place, so statuses added by inline probes while this runs
+        # are kept.
+        for name in self.statuses.keys() - urls.keys() - self._probed_inline:
+            del self.statuses[name]
+        self._probed_inline.clear()
+        for name, url in urls.items():
+            self.statuses[name] = self._get_status(name, url)
+        now = time.monotonic()
+        due = [s for s in self.statuses.values() if s.next_probe <= now]
+        await asyncio.gather(*(self._probe_device(client, s) for s in due))
+
+    async def _probe_inline(self, name: str, url: str) -> DeviceStatus:
+        status = DeviceStatus(url=url)
+        await self._probe_device(self._client, status)
+        current = self.statuses.get(name)
+        if current is not None and current.url == url:
+            # A probe cycle picked the device up meanwhile.
+            return current
+        self.statuses[name] = status
+        self._probed_inline.add(name)
+        return status
+
+    def _get_status(self, name: str, url: str) -> DeviceStatus:
+        status = self.statuses.get(name)
+        if status is None or status.url != url:
+            return DeviceStatus(url=url)
+        return status
+
+    async def _probe_device(self, client: httpx.AsyncClient, status: DeviceStatus):
+        start = time.monotonic()
+        try:
+            response = await client.get(f"{status.url}/status")
+            active = response.status_code == 200
+        except httpx.RequestError:
+            active = False
+        end = time.monotonic()
+        status.active = active
+        if active:
+            status.last_seen = datetime.now(timezone.utc)
+            status.latency = end - start
+            status.consecutive_failures = 0
+            status.next_probe = end
+        else:
+            status.consecutive_failures += 1
+            status.next_probe = end + self._backoff(status.consecutive_failures)
+
+    def _backoff(self, consecutive_failures: int) -> float:
+        if consecutive_failures < self.failure_threshold:
+            return 0.0
+        exponent = consecutive_failures - self.failure_threshold
+        return min(self.interval * 2**exponent, self.max_backoff)
@@ -0,0 +1,162 @@
+from dataclasses import dataclass
+import json
+import subprocess
+
+import ffmpeg
+
+# Seconds from the start of a recording read to measure its keyframe interval,
+# so probing does not read every packet of a long or remote file.
+KEYFRAME_PROBE_WINDOW = 20
+
+
+@dataclass
+class MediaInfo:
+    duration: float
+    width: int | None = None
+    height: int | None = None
+    codec: str | None = None
+    bitrate: int | None = None
+    size: int | None = None
+    keyframe_interval: float | None = None
+
+
+@dataclass
+class VideoStream:
+    codec: str | None
+    profile: str | None
+    level: int | None
+    width: int | None
+    height: int | None
+    pix_fmt: str | None
+    frame_rate: str | None
+    # Hash of the codec parameter sets, which stream copied parts of different
+    # files can only share when they are identical.
+    extradata_hash: str | None
+    # What ffmpeg -ss offsets into the file are relative to.
+    start_time: float
+
+
+def probe_media(path: str) -> MediaInfo:
+    probe = ffmpeg.probe(
+        path,
+        select_streams="v:0",
+        show_entries="packet=pts_time,flags",
+        read_intervals=f"%+{KEYFRAME_PROBE_WINDOW}",
+    )
+    format_ = probe["format"]
+    return _media_info(
+        probe,
+        duration=float(format_["duration"]),
+        bitrate=_int_or_none(format_.get("bit_rate")),
+        size=_int_or_none(format_.get("size")),
+    )
+
+
+def probe_media_prefix(prefix: bytes, duration: float, size: int) -> MediaInfo:
+    """
+    Probe the start of a streamable recording held in memory. The duration and
+    size of the whole recording are known to the caller, not from the prefix.
+    """
+    process = subprocess.run(
+        [
+            "ffprobe",
+            "-show_format",
+            "-show_streams",
+            "-of",
+            "json",
+            "-select_streams",
+            "v:0",
+            "-show_entries",
+            "packet=pts_time,flags",
+            "-read_intervals",
+            f"%+{KEYFRAME_PROBE_WINDOW}",
+            "pipe:",
+        ],
+        input=prefix,
+        capture_output=True,
+    )
+    if process.returncode != 0:
+        raise ffmpeg.Error("ffprobe", process.stdout, process.stderr)
+    return _media_info(
+        json.loads(process.stdout),
+        duration=duration,
+        bitrate=round(size * 8 / duration) if duration else None,
+        size=size,
+    )
+
+
+def _media_info(
+    probe: dict, duration: float, bitrate: int | None, size: int | None
+) -> MediaInfo:
+    video = probe["streams"][0] if probe["streams"] else {}
+    return MediaInfo(
+        duration=duration,
+        width=video.get("width"),
+        height=video.get("height"),
+        codec=video.get("codec_name"),
+        bitrate=bitrate,
+        size=size,
+        keyframe_interval=_keyframe_interval(probe.get("packets", [])),
+    )
+
+
+def probe_video_stream(path: str) -> VideoStream:
+    """Read the video stream parameters from the header, without any packets."""
+    probe = ffmpeg.probe(
+        path,
+        select_streams="v:0",
+        show_entries=(
+            "stream=codec_name,profile,level,width,height,pix_fmt,avg_frame_rate,"
+            "extradata_hash:format=start_time"
+        ),
+        show_data_hash="sha256",
+    )
+    video = probe["streams"][0]
+    return VideoStream(
+        codec=video.get("codec_name"),
+        profile=video.get("profile"),
+        level=video.get("level"),
+        width=video.get("width"),
+        height=video.get("height"),
+        pix_fmt=video.get("pix_fmt"),
+        frame_rate=video.get("avg_frame_rate"),
+        extradata_hash=video.get("extradata_hash"),
+        start_time=float(probe["format"].get("start_time", 0)),
+    )
+
+
+def probe_keyframes_before(path: str, times: list[float]) -> list[float | None]:
+    """
+    Time of the video keyframe at or before each of times, reading only the
+    packet that seeking to each one lands on.
+    """
+    probe = ffmpeg.probe(
+        path,
+        select_streams="v:0",
+        show_entries="packet=pts_time,flags",
+        read_intervals=",".join(f"{t:.6f}%+#1" for t in times),
+    )
+    packets = probe.get("packets", [])
+    if len(packets) != len(times):
+        return [None] * len(times)
+    return [
+        float(p["pts_time"])
+        if "K" in p.get("flags", "") and p.get("pts_time") not in (None, "N/A")
+        else None
+        for p in packets
+    ]
+
+
+def _keyframe_interval(packets: list[dict]) -> float | None:
+    keyframes = [
+        float(p["pts_time"])
+        for p in packets
+        if "K" in p.get("flags", "") and p.get("pts_time") not in (None, "N/A")
+    ]
+    if len(keyframes) < 2:
+        return None
+    return (keyframes[-1] - keyframes[0]) / (len(keyframes) - 1)
+
+
+def _int_or_none(value: str | None) -> int | None:
+    return int(value) if value not in (None, "N/A") else None
@@ -0,0 +1,104 @@
+import asyncio
+from typing import AsyncIterator, Mapping
+
+import httpx
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from src.segment_cache import StreamedObject
+
+FORWARDED_REQUEST_HEADERS = {
+    "range",
+    "if-range",
+    "if-match",
+    "if-none-match",
+    "if-modified-since",
+    "if-unmodified-since",
+}
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+}
+
+
+class DeviceProxy:
+    def __init__(
+        self, max_connections_per_device: int = 10, timeout: float = 20.0
+    ) -> None:
+        self.max_connections_per_device = max_connections_per_device
+        self.timeout = timeout
+        self._clients: dict[str, httpx.AsyncClient] = {}
+
+    async def forward(
+        self,
+        base_url: str,
+        path: str,
+        params: Mapping[str, str],
+        headers: Mapping[str, str],
+    ) -> StreamingResponse:
+        client = self._get_client(base_url)
+        request = client.build_request(
+            "GET",
+            f"{base_url}/{path}",
+            params=params,
+            headers=_filter_headers(headers, FORWARDED_REQUEST_HEADERS),
+        )
+        response = await client.send(request, stream=True)
+        return StreamingResponse(
+            response.aiter_raw(),
+            status_code=response.status_code,
+            headers={
+                k: v
+                for k, v in response.headers.items()
+                if k.lower() not in HOP_BY_HOP_HEADERS
+            },
+            background=BackgroundTask(response.aclose),
+        )
+
+    async def open(self, base_url: str, path: str) -> StreamedObject:
+        """Start a GET and return the decoded body as it arrives."""
+        client = self._get_client(base_url)
+        response = await client.send(
+            client.build_request("GET", f"{base_url}/{path}"), stream=True
+        )
+        return StreamedObject(
+            status_code=response.status_code,
+            media_type=response.headers.get("content-type"),
+            chunks=_read_and_close(response),
+        )
+
+    async def close(self) -> None:
+        clients = list(self._clients.values())
+        self._clients.clear()
+        await asyncio.gather(*(client.aclose() for client in clients))
+
+    def _get_client(self, base_url: str) -> httpx.AsyncClient:
+        client = self._clients.get(base_url)
+        if client is None:
+            client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections_per_device,
+                    max_keepalive_connections=self.max_connections_per_device,
+                ),
+            )
+            self._clients[base_url] = client
+        return client
+
+
+def _filter_headers(headers: Mapping[str, str], allowed: set[str]) -> dict[str, str]:
+    return {k: v for k, v in headers.items() if k.lower() in allowed}
+
+
+async def _read_and_close(response: httpx.Response) -> AsyncIterator[bytes]:
+    try:
+        async for chunk in response.aiter_bytes():
+            yield chunk
+    finally:
+        await response.aclose()
@@ -1,17 +1,60 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
-from tempfile import NamedTemporaryFile
+import enum
+import io
+import json
+import subprocess
+import shutil
+from threading import Event
+import time
+from typing import BinaryIO, Callable, Iterator
+from urllib.parse import urljoin
 import ffmpeg
 import httpx
 
 
 import logging
 from pathlib import Path
-from subprocess import CalledProcessError
 
 import src.db.models as models
-from src.gcs import upload_to_gcs
+from src.gcs import get_public_url, open_gcs_writer
+from src.media import MediaInfo, probe_media, probe_media_prefix
 
-from sqlmodel import Session
+
+class RecordingMode(enum.StrEnum):
+    COPY = "copy"
+    TRANSCODE = "transcode"
+
+
+COPY_VIDEO_CODECS = {"h264"}
+COPY_VIDEO_PROFILES = {"Constrained Baseline", "Baseline", "Main", "High"}
+COPY_PIXEL_FORMATS = {"yuv420p", "yuvj420p"}
+COPY_AUDIO_CODECS = {"aac"}
+FRAGMENTED_MP4_FLAGS = "frag_keyframe+empty_moov+default_base_moof"
+
+SEGMENT_CONCURRENCY = 4
+SEGMENT_RETRIES = 3
+SEGMENT_TIMEOUT = 20.0
+STALL_TIMEOUT = 30.0
+# Start of an uploaded recording kept in memory to probe it, several keyframe
+# intervals at the bitrate recordings are started with.
+PROBE_PREFIX_BYTES = 16 * 1024 * 1024
+
+
+@dataclass
+class Segment:
+    sequence: int
+    url: str
+    duration: float
+
+
+@dataclass
+class Playlist:
+    target_duration: float
+    segments: list[Segment]
+    ended: bool
 
 
 def record_and_save(
@@ -20,59 +63,342 @@ def record_and_save(
     device: models.Device,
     recording_dir: str,
     duration: int,
-    session: Session,
-) -> None:
+    mode: RecordingMode = RecordingMode.COPY,
+    on_progress: Callable[[float], None] | None = None,
+    cancelled: Event | None = None,
+) -> tuple[str, MediaInfo | None]:
     output_path = f"{recording_dir}/{device.name}/{datetime.now().isoformat()}.mp4"
     if recording_dir.startswith("gs://"):
-        with NamedTemporaryFile(suffix=".mp4") as temp_file:
-            _record(device_url, device.name, temp_file.name, duration)
-            url = upload_to_gcs(temp_file.name, output_path)
+        with open_gcs_writer(output_path, "video/mp4") as writer:
+            upload = _PrefixWriter(writer, PROBE_PREFIX_BYTES)
+            recorded = _record(
+                device_url,
+                device.name,
+                upload,  # type: ignore
+                duration,
+                mode,
+                on_progress,
+                cancelled,
+            )
+        url = get_public_url(output_path)
+        media = _probe_recording_prefix(url, upload, recorded)
     else:
-        _record(device_url, device.name, output_path, duration)
+        _record(
+            device_url,
+            device.name,
+            output_path,
+            duration,
+            mode,
+            on_progress,
+            cancelled,
+        )
         url = _get_local_recording_url(base_url, recording_dir, Path(output_path))
+        media = _probe_recording(output_path)
     logging.info(f"Saved recording for {device.name} to {url}")
-    recording = models.Recording(
-        device_id=device.id,
-        url=url,
-    )
-    session.add(recording)
-    session.commit()
-    session.refresh(recording)
+    return url, media
+
+
+class _PrefixWriter(io.RawIOBase):
+    """Write through to file, keeping the first max_bytes written in memory."""
 
+    def __init__(self, file: BinaryIO, max_bytes: int) -> None:
+        self.file = file
+        self.max_bytes = max_bytes
+        self.prefix = bytearray()
+        self.size = 0
 
-def _record(device_url: str, device: str, output_path: str, duration: int) -> None:
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.file.write(data)
+        if len(self.prefix) < self.max_bytes:
+            self.prefix += data[: self.max_bytes - len(self.prefix)]
+        self.size += len(data)
+        return len(data)
+
+
+def _probe_recording(path: str) -> MediaInfo | None:
+    try:
+        return probe_media(path)
+    except (ffmpeg.Error, OSError, KeyError, ValueError) as e:
+        logging.warning(f"Failed to probe recording {path}: {e}")
+        return None
+
+
+def _probe_recording_prefix(
+    url: str, upload: _PrefixWriter, duration: float
+) -> MediaInfo | None:
+    try:
+        return probe_media_prefix(bytes(upload.prefix), duration, upload.size)
+    except (ffmpeg.Error, OSError, KeyError, ValueError) as e:
+        logging.warning(f"Failed to probe recording {url}: {e}")
+        return None
+
+
+def _record(
+    device_url: str,
+    device: str,
+    output: str | BinaryIO,
+    duration: int,
+    mode: RecordingMode,
+    on_progress: Callable[[float], None] | None = None,
+    cancelled: Event | None = None,
+) -> float:
+    """Record duration seconds to output and return how many were captured."""
     logging.info(f"Saving recording for {device}")
-    start_url = f"{device_url}/start"
-    start_response = httpx.get(
-        start_url, params={"bitrate": 10000000, "framerate": 30}, timeout=60.0
-    )
+    with httpx.Client(timeout=SEGMENT_TIMEOUT) as client:
+        try:
+            start_response = client.get(
+                f"{device_url}/start",
+                params={"bitrate": 10000000, "framerate": 30},
+                timeout=60.0,
+            )
+            start_response.raise_for_status()
+        except httpx.HTTPError as e:
+            logging.error(f"Failed to start recording for {device}: {e}")
+            raise RuntimeError(f"Failed to start recording for {device}: {e}") from e
+        playlist_url = f"{device_url}{start_response.json()['playlist']}"
+        segments = _capture_segments(client, playlist_url, duration, cancelled)
+        first_segment = next(segments, None)
+        if first_segment is None:
+            raise RuntimeError(f"No segments received for {device}")
+        if mode == RecordingMode.COPY and not _is_copy_compatible(first_segment[0]):
+            logging.info(f"Stream for {device} cannot be copied, transcoding instead")
+            mode = RecordingMode.TRANSCODE
+        input_ = ffmpeg.input("pipe:", f="mpegts")
+        if isinstance(output, str):
+            Path(output).parent.mkdir(parents=True, exist_ok=True)
+            output_stream = ffmpeg.output(
+                input_, output, t=duration, **_get_output_args(mode)
+            )
+        else:
+            output_stream = ffmpeg.output(
+                input_,
+                "pipe:1",
+                t=duration,
+                **{
+                    **_get_output_args(mode),
+                    "f": "mp4",
+                    "movflags": FRAGMENTED_MP4_FLAGS,
+                },
+            )
+        try:
+            captured = _mux(
+                output_stream,
+                _chain(first_segment, segments),
+                duration,
+                on_progress,
+                None if isinstance(output, str) else output,
+            )
+            if cancelled and cancelled.is_set():
+                raise RuntimeError("Recording cancelled")
+        except RuntimeError as e:
+            logging.error(f"Failed to record video for {device}: {e}")
+            if isinstance(output, str):
+                Path(output).unlink(missing_ok=True)
+            raise
+    logging.info(f"Finished recording video for {device}")
+    return min(captured, duration)
+
+
+def _chain(
+    first: tuple[bytes, float], rest: Iterator[tuple[bytes, float]]
+) -> Iterator[tuple[bytes, float]]:
+    yield first
+    yield from rest
+
+
+def _capture_segments(
+    client: httpx.Client,
+    playlist_url: str,
+    duration: float,
+    cancelled: Event | None = None,
+) -> Iterator[tuple[bytes, float]]:
+    """
+    Follow a live HLS playlist from its newest segment and yield segment contents
+    in order until they cover duration seconds.
+    """
+    next_sequence: int | None = None
+    queued = 0.0
+    pending: deque[tuple[Segment, Future[bytes]]] = deque()
+    last_segment_at = time.monotonic()
+    with ThreadPoolExecutor(max_workers=SEGMENT_CONCURRENCY) as executor:
+        while queued < duration and not (cancelled and cancelled.is_set()):
+            try:
+                playlist = _get_playlist(client, playlist_url)
+            except httpx.HTTPError as e:
+                if time.monotonic() - last_segment_at > STALL_TIMEOUT:
+                    raise RuntimeError(f"Stream stalled: {e}") from e
+                logging.warning(f"Failed to reload {playlist_url}: {e}")
+                time.sleep(1.0)
+                continue
+            new_segments = (
+                playlist.segments[-1:]
+                if next_sequence is None
+                else [s for s in playlist.segments if s.sequence >= next_sequence]
+            )
+            if next_sequence is not None and new_segments:
+                skipped = new_segments[0].sequence - next_sequence
+                if skipped:
+                    logging.warning(f"Skipped {skipped} segments of {playlist_url}")
+            for segment in new_segments:
+                if queued >= duration:
+                    break
+                future = executor.submit(_get_segment, client, segment.url)
+                pending.append((segment, future))
+                queued += segment.duration
+                next_sequence = segment.sequence + 1
+                last_segment_at = time.monotonic()
+            while pending and pending[0][1].done():
+                yield from _segment_result(*pending.popleft())
+            if queued >= duration or playlist.ended:
+                break
+            if time.monotonic() - last_segment_at > STALL_TIMEOUT:
+                raise RuntimeError(f"No new segments in {playlist_url}")
+            time.sleep(playlist.target_duration / 2)
+        while pending:
+            yield from _segment_result(*pending.popleft())
+
+
+def _segment_result(
+    segment: Segment, future: Future[bytes]
+) -> Iterator[tuple[bytes, float]]:
     try:
-        start_response.raise_for_status()
-    except httpx.HTTPStatusError as e:
-        logging.error(f"Failed to start recording for {device}: {e}")
-        raise RuntimeError(f"Failed to start recording for {device}: {e}") from e
-    playlist_path = start_response.json()["playlist"]
-    playlist_url = f"{device_url}{playlist_path}"
-    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
-    input_ = ffmpeg.input(playlist_url, t=duration)
-    output = ffmpeg.output(
-        input_,
-        output_path,
-        vcodec="libx264",
-        acodec="aac",
-        movflags="+faststart",
-        profile="main",
-        pix_fmt="yuv420p",
+        yield future.result(), segment.duration
+    except httpx.HTTPError as e:
+        logging.warning(f"Dropping segment {segment.url}: {e}")
+
+
+def _get_playlist(client: httpx.Client, url: str) -> Playlist:
+    response = client.get(url, headers={"Cache-Control": "no-cache"})
+    response.raise_for_status()
+    return _parse_playlist(response.text, url)
+
+
+def _parse_playlist(text: str, url: str) -> Playlist:
+    target_duration = 5.0
+    sequence = 0
+    segment_duration = None
+    segments = []
+    ended = False
+    for line in map(str.strip, text.splitlines()):
+        tag, _, value = line.partition(":")
+        if tag == "#EXT-X-TARGETDURATION":
+            target_duration = float(value)
+        elif tag == "#EXT-X-MEDIA-SEQUENCE":
+            sequence = int(value)
+        elif tag == "#EXTINF":
+            segment_duration = float(value.split(",")[0])
+        elif tag == "#EXT-X-ENDLIST":
+            ended = True
+        elif line and not line.startswith("#"):
+            segments.append(
+                Segment(sequence, urljoin(url, line), segment_duration or 0.0)
+            )
+            sequence += 1
+            segment_duration = None
+    return Playlist(target_duration, segments, ended)
+
+
+def _get_segment(client: httpx.Client, url: str) -> bytes:
+    for attempt in range(SEGMENT_RETRIES + 1):
+        try:
+            response = client.get(url)
+            response.raise_for_status()
+            return response.content
+        except httpx.HTTPError:
+            if attempt == SEGMENT_RETRIES:
+                raise
+            time.sleep(0.5 * 2**attempt)
+    raise AssertionError("unreachable")
+
+
+def _mux(
+    output: ffmpeg.nodes.OutputStream,
+    segments: Iterator[tuple[bytes, float]],
+    duration: float,
+    on_progress: Callable[[float], None] | None,
+    sink: BinaryIO | None = None,
+) -> float:
+    process = ffmpeg.run_async(
+        output.global_args("-nostats", "-loglevel", "error"),
+        pipe_stdin=True,
+        pipe_stdout=sink is not None,
+        pipe_stderr=True,
+        overwrite_output=True,
     )
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        stderr = executor.submit(process.stderr.read)
+        drained = executor.submit(_drain, process, sink) if sink else None
+        captured = 0.0
+        try:
+            for content, segment_duration in segments:
+                process.stdin.write(content)
+                captured += segment_duration
+                if on_progress:
+                    on_progress(min(captured / duration, 1.0))
+        except BrokenPipeError:
+            pass
+        except BaseException:
+            process.kill()
+            raise
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+            process.wait()
+    if drained:
+        drained.result()
+    if process.returncode != 0:
+        raise RuntimeError(
+            f"ffmpeg exited with {process.returncode}: {stderr.result().decode()}"
+        )
+    return captured
+
+
+def _drain(process: subprocess.Popen, sink: BinaryIO) -> None:
     try:
-        ffmpeg.run(output, overwrite_output=True, quiet=True)
-        logging.info(f"Finished recording video for {device} to {output_path}")
-    except CalledProcessError as e:
-        logging.error(
-            f"Failed to record video for {device}: {e}\n"
-            f"stderr: {e.stderr}\n"
-            f"stdout: {e.stdout}"
+        shutil.copyfileobj(process.stdout, sink)
+    except BaseException:
+        process.kill()
+        raise
+
+
+def _is_copy_compatible(segment: bytes) -> bool:
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-of", "json", "-show_streams", "pipe:"],
+            input=segment,
+            capture_output=True,
+            check=True,
         )
+        streams = json.loads(result.stdout)["streams"]
+    except (subprocess.CalledProcessError, OSError, ValueError, KeyError) as e:
+        logging.warning(f"Failed to probe stream: {e}")
+        return False
+    video = [s for s in streams if s["codec_type"] == "video"]
+    audio = [s for s in streams if s["codec_type"] == "audio"]
+    return (
+        len(video) == 1
+        and video[0].get("codec_name") in COPY_VIDEO_CODECS
+        and video[0].get("profile") in COPY_VIDEO_PROFILES
+        and video[0].get("pix_fmt") in COPY_PIXEL_FORMATS
+        and all(a.get("codec_name") in COPY_AUDIO_CODECS for a in audio)
+    )
+
+
+def _get_output_args(mode: RecordingMode) -> dict[str, str]:
+    if mode == RecordingMode.COPY:
+        return {"c": "copy", "bsf:a": "aac_adtstoasc", "movflags": "+faststart"}
+    return {
+        "vcodec": "libx264",
+        "acodec": "aac",
+        "movflags": "+faststart",
+        "profile": "main",
+        "pix_fmt": "yuv420p",
+    }
 
 
 def _get_local_recording_url(url: str, recording_dir: str, path: Path) -> str:
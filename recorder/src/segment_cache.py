@@ -0,0 +1,352 @@
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass
+import hashlib
+import logging
+import os
+from pathlib import Path, PurePosixPath
+import time
+from typing import AsyncIterator, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+PLAYLIST_SUFFIX = ".m3u8"
+SEGMENT_SUFFIX = ".ts"
+TEMP_SUFFIX = f".tmp{SEGMENT_SUFFIX}"
+
+
+@dataclass
+class CachedObject:
+    status_code: int
+    content: bytes
+    media_type: str | None
+
+
+@dataclass
+class StreamedObject:
+    status_code: int
+    media_type: str | None
+    chunks: AsyncIterator[bytes]
+
+
+@dataclass
+class CacheStats:
+    hits: int
+    misses: int
+    shared_fetches: int
+    memory_bytes: int
+    disk_bytes: int
+
+
+Fetch = Callable[[str], Awaitable[CachedObject]]
+StreamFetch = Callable[[str], Awaitable[StreamedObject]]
+
+
+def is_cacheable(path: str) -> bool:
+    return PurePosixPath(path).suffix in {PLAYLIST_SUFFIX, SEGMENT_SUFFIX}
+
+
+class SegmentCache:
+    def __init__(
+        self,
+        max_bytes: int = 256 * 1024 * 1024,
+        disk_dir: str | None = None,
+        disk_max_bytes: int = 2 * 1024 * 1024 * 1024,
+        playlist_ttl: float = 1.0,
+        prefetch_segments: int = 3,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_bytes = disk_max_bytes
+        self.playlist_ttl = playlist_ttl
+        self.prefetch_segments = prefetch_segments
+        self.hits = 0
+        self.misses = 0
+        self.shared_fetches = 0
+        self._memory: OrderedDict[tuple[str, str], CachedObject] = OrderedDict()
+        self._memory_bytes = 0
+        # Disk entries are keyed by file name so the index can be rebuilt from
+        # the directory on start.
+        self._disk: OrderedDict[str, int] = OrderedDict()
+        self._disk_bytes = 0
+        self._playlists: dict[tuple[str, str], tuple[CachedObject, float]] = {}
+        self._in_flight: dict[tuple[str, str], asyncio.Future[CachedObject]] = {}
+        self._tasks: set[asyncio.Task] = set()
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self._load_disk()
+
+    @property
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            hits=self.hits,
+            misses=self.misses,
+            shared_fetches=self.shared_fetches,
+            memory_bytes=self._memory_bytes,
+            disk_bytes=self._disk_bytes,
+        )
+
+    async def get(self, device: str, path: str, fetch: Fetch) -> CachedObject:
+        key = (device, path)
+        if future := self._in_flight.get(key):
+            self.shared_fetches += 1
+            return await asyncio.shield(future)
+        if (cached := self._lookup_memory(key)) is not None:
+            self.hits += 1
+            return cached
+        # Registered before any await so concurrent misses share one read.
+        future = self._begin(key)
+        try:
+            obj = await self._read_disk(key)
+            if obj is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                obj = await fetch(path)
+        except BaseException as e:
+            self._abort(key, future, e)
+            raise
+        self._complete(key, future, obj)
+        if obj.status_code == 200:
+            await self._store(key, obj)
+            if path.endswith(PLAYLIST_SUFFIX):
+                self._prefetch_segments(device, path, obj, fetch)
+        return obj
+
+    async def stream(
+        self, device: str, path: str, fetch: StreamFetch
+    ) -> CachedObject | StreamedObject:
+        """
+        Like get, but a segment missing from the cache is streamed to the caller
+        as it arrives, while it is stored for the cache and concurrent requests.
+        """
+        key = (device, path)
+        if (
+            path.endswith(PLAYLIST_SUFFIX)
+            or key in self._in_flight
+            or key in self._memory
+            or self._disk_name(key) in self._disk
+        ):
+            return await self.get(device, path, lambda p: _collect(fetch(p)))
+        self.misses += 1
+        future = self._begin(key)
+        try:
+            streamed = await fetch(path)
+        except BaseException as e:
+            self._abort(key, future, e)
+            raise
+        chunks: asyncio.Queue[bytes | BaseException | None] = asyncio.Queue()
+        # Runs to completion even if the caller stops reading, so the segment
+        # still reaches the cache and everyone waiting on it.
+        self._spawn(self._fill(key, future, streamed, chunks))
+        return StreamedObject(streamed.status_code, streamed.media_type, _drain(chunks))
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _begin(self, key: tuple[str, str]) -> asyncio.Future[CachedObject]:
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        return future
+
+    def _complete(
+        self,
+        key: tuple[str, str],
+        future: asyncio.Future[CachedObject],
+        obj: CachedObject,
+    ) -> None:
+        del self._in_flight[key]
+        future.set_result(obj)
+
+    def _abort(
+        self,
+        key: tuple[str, str],
+        future: asyncio.Future[CachedObject],
+        error: BaseException,
+    ) -> None:
+        del self._in_flight[key]
+        if isinstance(error, asyncio.CancelledError):
+            future.cancel()
+        else:
+            future.set_exception(error)
+            future.exception()
+
+    async def _fill(
+        self,
+        key: tuple[str, str],
+        future: asyncio.Future[CachedObject],
+        streamed: StreamedObject,
+        chunks: asyncio.Queue[bytes | BaseException | None],
+    ) -> None:
+        content = bytearray()
+        try:
+            async for chunk in streamed.chunks:
+                content += chunk
+                chunks.put_nowait(chunk)
+        except asyncio.CancelledError as e:
+            chunks.put_nowait(e)
+            self._abort(key, future, e)
+            raise
+        except Exception as e:
+            logger.warning(f"Failed to fetch {key[1]} for {key[0]}: {e}")
+            chunks.put_nowait(e)
+            self._abort(key, future, e)
+            return
+        chunks.put_nowait(None)
+        obj = CachedObject(streamed.status_code, bytes(content), streamed.media_type)
+        self._complete(key, future, obj)
+        if obj.status_code == 200:
+            await self._store(key, obj)
+
+    def _spawn(self, coroutine: Awaitable[None]) -> None:
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _lookup_memory(self, key: tuple[str, str]) -> CachedObject | None:
+        if key[1].endswith(PLAYLIST_SUFFIX):
+            obj, expires_at = self._playlists.get(key, (None, 0.0))
+            return obj if expires_at > time.monotonic() else None
+        if obj := self._memory.get(key):
+            self._memory.move_to_end(key)
+        return obj
+
+    async def _read_disk(self, key: tuple[str, str]) -> CachedObject | None:
+        name = self._disk_name(key)
+        if key[1].endswith(PLAYLIST_SUFFIX) or name not in self._disk:
+            return None
+        self._disk.move_to_end(name)
+        try:
+            content = await asyncio.to_thread(_touch_and_read, self._disk_path(name))
+        except OSError:
+            self._disk_bytes -= self._disk.pop(name, 0)
+            return None
+        return CachedObject(200, content, _media_type(key[1]))
+
+    async def _store(self, key: tuple[str, str], obj: CachedObject) -> None:
+        if key[1].endswith(PLAYLIST_SUFFIX):
+            now = time.monotonic()
+            # Only playlists fetched within the TTL are kept, so devices that
+            # stop being watched do not leave entries behind.
+            self._playlists = {k: v for k, v in self._playlists.items() if v[1] > now}
+            self._playlists[key] = (obj, now + self.playlist_ttl)
+            return
+        self._store_in_memory(key, obj)
+        if self.disk_dir and self._disk_name(key) not in self._disk:
+            await self._store_on_disk(self._disk_name(key), obj.content)
+
+    def _store_in_memory(self, key: tuple[str, str], obj: CachedObject) -> None:
+        if key in self._memory:
+            return
+        self._memory[key] = obj
+        self._memory_bytes += len(obj.content)
+        while self._memory_bytes > self.max_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted.content)
+
+    async def _store_on_disk(self, name: str, content: bytes) -> None:
+        await asyncio.to_thread(_write_atomic, self._disk_path(name), content)
+        if name in self._disk:
+            return
+        self._disk[name] = len(content)
+        self._disk_bytes += len(content)
+        for path in self._evict_from_disk():
+            await asyncio.to_thread(path.unlink, missing_ok=True)
+
+    def _evict_from_disk(self) -> list[Path]:
+        evicted_paths = []
+        while self._disk_bytes > self.disk_max_bytes and self._disk:
+            evicted_name, size = self._disk.popitem(last=False)
+            evicted_paths.append(self._disk_path(evicted_name))
+            self._disk_bytes -= size
+        return evicted_paths
+
+    def _load_disk(self) -> None:
+        assert self.disk_dir is not None
+        entries = []
+        for path in self.disk_dir.glob(f"*{SEGMENT_SUFFIX}"):
+            if path.name.endswith(TEMP_SUFFIX):
+                # Left behind by a write that did not finish.
+                path.unlink(missing_ok=True)
+                continue
+            stat = path.stat()
+            entries.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._disk[name] = size
+            self._disk_bytes += size
+        logger.info(
+            f"Loaded {len(self._disk)} cached segments ({self._disk_bytes} bytes) "
+            f"from {self.disk_dir}"
+        )
+        for path in self._evict_from_disk():
+            path.unlink(missing_ok=True)
+
+    def _disk_name(self, key: tuple[str, str]) -> str:
+        return hashlib.sha256("/".join(key).encode()).hexdigest()
+
+    def _disk_path(self, name: str) -> Path:
+        assert self.disk_dir is not None
+        return self.disk_dir / f"{name}{SEGMENT_SUFFIX}"
+
+    def _prefetch_segments(
+        self, device: str, playlist_path: str, playlist: CachedObject, fetch: Fetch
+    ) -> None:
+        if self.prefetch_segments <= 0:
+            return
+        directory = PurePosixPath(playlist_path).parent
+        lines = playlist.content.decode(errors="ignore").splitlines()
+        segments = [
+            line.strip()
+            for line in lines
+            if line.strip().endswith(SEGMENT_SUFFIX) and not line.startswith("#")
+        ]
+        for segment in segments[-self.prefetch_segments :]:
+            segment_path = str(directory / segment)
+            key = (device, segment_path)
+            if (
+                key in self._memory
+                or self._disk_name(key) in self._disk
+                or key in self._in_flight
+            ):
+                continue
+            self._spawn(self._prefetch(device, segment_path, fetch))
+
+    async def _prefetch(self, device: str, path: str, fetch: Fetch) -> None:
+        try:
+            await self.get(device, path, fetch)
+        except Exception as e:
+            logger.warning(f"Failed to prefetch {path} for {device}: {e}")
+
+
+async def _collect(streamed: Awaitable[StreamedObject]) -> CachedObject:
+    obj = await streamed
+    content = b"".join([chunk async for chunk in obj.chunks])
+    return CachedObject(obj.status_code, content, obj.media_type)
+
+
+async def _drain(
+    chunks: asyncio.Queue[bytes | BaseException | None],
+) -> AsyncIterator[bytes]:
+    while (chunk := await chunks.get()) is not None:
+        if isinstance(chunk, BaseException):
+            raise chunk
+        yield chunk
+
+
+def _touch_and_read(path: Path) -> bytes:
+    os.utime(path)
+    return path.read_bytes()
+
+
+def _write_atomic(path: Path, content: bytes) -> None:
+    temp_path = path.with_name(f"{path.stem}{TEMP_SUFFIX}")
+    temp_path.write_bytes(content)
+    os.replace(temp_path, path)
+
+
+def _media_type(path: str) -> str:
+    if path.endswith(PLAYLIST_SUFFIX):
+        return "application/vnd.apple.mpegurl"
+    return "video/mp2t"
@@ -0,0 +1,68 @@
+import asyncio
+from dataclasses import dataclass
+import logging
+import time
+
+import httpx
+
+import src.db.models as models
+
+
+@dataclass
+class SensorReport:
+    device: str
+    success: bool
+    latency: float
+    error: str | None = None
+
+
+async def collect_sensors(
+    client: httpx.AsyncClient,
+    devices: list[tuple[models.Device, str]],
+    max_concurrency: int = 8,
+    timeout: float = 10.0,
+) -> tuple[list[models.Sensor], list[SensorReport]]:
+    """
+    Read the sensors of every device, at most max_concurrency at a time. Each
+    device gets timeout seconds in total, however its requests are spent.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    results = await asyncio.gather(
+        *(_collect_sensor(client, semaphore, timeout, *d) for d in devices)
+    )
+    sensors = [sensor for sensor, _ in results if sensor]
+    reports = [report for _, report in results]
+    return sensors, reports
+
+
+async def _collect_sensor(
+    client: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore,
+    timeout: float,
+    device: models.Device,
+    url: str,
+) -> tuple[models.Sensor | None, SensorReport]:
+    async with semaphore:
+        start = time.monotonic()
+        try:
+            response = await asyncio.wait_for(client.get(f"{url}/sensor"), timeout)
+            response.raise_for_status()
+            sensor_data = response.json()
+            sensor = models.Sensor(
+                device_id=device.id,
+                temperature=sensor_data["temperature"],
+                humidity=sensor_data["humidity"],
+                cpu_temperature=sensor_data["cpu_temperature"],
+            )
+        except TimeoutError:
+            error = f"No response within {timeout}s"
+            logging.error(f"Failed to get sensor data for {device.name}: {error}")
+            return None, SensorReport(
+                device.name, False, time.monotonic() - start, error
+            )
+        except (httpx.HTTPError, ValueError, KeyError) as e:
+            logging.error(f"Failed to get sensor data for {device.name}: {e}")
+            return None, SensorReport(
+                device.name, False, time.monotonic() - start, str(e)
+            )
+    return sensor, SensorReport(device.name, True, time.monotonic() - start)
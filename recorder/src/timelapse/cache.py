@@ -0,0 +1,104 @@
+from collections import Counter, OrderedDict
+import logging
+import os
+from pathlib import Path
+import threading
+from uuid import uuid4
+
+logger = logging.getLogger(__name__)
+
+SUFFIX = ".mov"
+TEMP_SUFFIX = f".tmp{SUFFIX}"
+
+
+class RenderCache:
+    """
+    Intermediate timelapse renders on disk, keyed by a hash of what they were
+    rendered from and evicted least recently used first once over max_bytes.
+    The index is rebuilt from the directory on start, so renders survive a
+    crashed or restarted job.
+    """
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._bytes = 0
+        self._pinned: Counter[str] = Counter()
+        self._lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    def path(self, key: str) -> Path:
+        return self.directory / f"{key}{SUFFIX}"
+
+    def temp_path(self, key: str) -> Path:
+        return self.directory / f"{key}.{uuid4().hex}{TEMP_SUFFIX}"
+
+    def get(self, key: str) -> Path | None:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._bytes -= self._entries.pop(key, 0)
+            return None
+        return path
+
+    def put(self, key: str, source: Path) -> Path:
+        path = self.path(key)
+        os.replace(source, path)
+        size = path.stat().st_size
+        with self._lock:
+            self._bytes += size - self._entries.get(key, 0)
+            self._entries[key] = size
+            self._entries.move_to_end(key)
+            evicted = self._evict()
+        for evicted_path in evicted:
+            evicted_path.unlink(missing_ok=True)
+        return path
+
+    def pin(self, key: str) -> None:
+        """Keep key from being evicted while a render still needs it."""
+        with self._lock:
+            self._pinned[key] += 1
+
+    def unpin(self, key: str) -> None:
+        with self._lock:
+            self._pinned[key] -= 1
+            if self._pinned[key] <= 0:
+                del self._pinned[key]
+
+    def _evict(self) -> list[Path]:
+        evicted = []
+        for key in list(self._entries):
+            if self._bytes <= self.max_bytes:
+                break
+            if key in self._pinned:
+                continue
+            self._bytes -= self._entries.pop(key)
+            evicted.append(self.path(key))
+        return evicted
+
+    def _load(self) -> None:
+        entries = []
+        for path in self.directory.glob(f"*{SUFFIX}"):
+            if path.name.endswith(TEMP_SUFFIX):
+                # Left behind by a render that did not finish.
+                path.unlink(missing_ok=True)
+                continue
+            stat = path.stat()
+            entries.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._bytes += size
+        logger.info(
+            f"Loaded {len(self._entries)} cached renders ({self._bytes} bytes) "
+            f"from {self.directory}"
+        )
+        for path in self._evict():
+            path.unlink(missing_ok=True)
@@ -1,9 +1,13 @@
-from src.db import queries, models
+from src.db import models
 from src.gcs import upload_to_gcs
-from src.timelapse.timelapse import make_timelapse
-
-
-from sqlmodel import Session
+from src.timelapse.cache import RenderCache
+from src.timelapse.timelapse import (
+    MemoryBudget,
+    MemoryProfile,
+    RenderMode,
+    RenderPlan,
+    make_timelapse,
+)
 
 
 import logging
@@ -12,6 +16,8 @@ import shutil
 from datetime import datetime
 from pathlib import Path
 from tempfile import NamedTemporaryFile
+from threading import Event
+from typing import Callable
 
 
 def create_and_save_timelapse(
@@ -22,13 +28,19 @@ def create_and_save_timelapse(
     fade_duration: float | None,
     batch_size: int | None,
     recording_dir: str,
-    session: Session,
-) -> None:
+    recordings: list[models.Recording],
+    workers: int | None = None,
+    memory_budget: MemoryBudget | None = None,
+    memory_profile: MemoryProfile | None = None,
+    on_progress: Callable[[float], None] | None = None,
+    mode: RenderMode = RenderMode.TRANSCODE,
+    cache: RenderCache | None = None,
+    cancelled: Event | None = None,
+) -> tuple[str, RenderPlan | None] | None:
     with NamedTemporaryFile(suffix=".mp4") as temp_file:
-        recordings = queries.get_recordings(session, device.name)
         if not recordings:
             logging.info(f"No recordings found for device {device}, skipping timelapse")
-            return
+            return None
         else:
             logging.info(f"Found {len(recordings)} recordings for device {device}")
         recordings_in_range = [r for r in recordings if start <= r.created_at <= end]
@@ -37,13 +49,22 @@ def create_and_save_timelapse(
         )
         urls = [r.url for r in recordings_in_range]
         times = [r.created_at for r in recordings_in_range]
-        make_timelapse(
+        plan = make_timelapse(
             urls,
             times,
             Path(temp_file.name),
             total_time=duration,
             fade_duration=fade_duration,
             batch_size=batch_size,
+            durations=[r.duration for r in recordings_in_range],
+            workers=workers,
+            memory_budget=memory_budget,
+            memory_profile=memory_profile,
+            on_progress=on_progress,
+            mode=mode,
+            keyframe_intervals=[r.keyframe_interval for r in recordings_in_range],
+            cache=cache,
+            cancelled=cancelled,
         )
         save_path = os.path.join(
             recording_dir,
@@ -52,6 +73,6 @@ def create_and_save_timelapse(
             f"{start.isoformat()}_{end.isoformat()}.mp4",
         )
         if recording_dir.startswith("gs://"):
-            upload_to_gcs(temp_file.name, str(save_path))
-        else:
-            shutil.move(temp_file.name, save_path)
+            return upload_to_gcs(temp_file.name, str(save_path)), plan
+        shutil.move(temp_file.name, save_path)
+        return save_path, plan
@@ -1,14 +1,102 @@
-from dataclasses import dataclass
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack, contextmanager, nullcontext
+from dataclasses import asdict, dataclass
+import enum
+from fractions import Fraction
+from functools import partial
+import hashlib
+import json
 from itertools import batched
 import logging
 import math
+import os
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
+import re
 import shutil
+import subprocess
 import tempfile
+from threading import Condition, Event
+from typing import Callable, ContextManager, Iterator
 from uuid import uuid4
 import ffmpeg
 
+from src.media import VideoStream, probe_keyframes_before, probe_video_stream
+from src.timelapse.cache import RenderCache
+
+PROBE_CONCURRENCY = 8
+CALIBRATION_INPUTS = 4
+HYPERLAPSE_FRAME_RATE = 24
+# Sampled frames decoded by one ffmpeg process, each from its own seeked input.
+HYPERLAPSE_CHUNK_SIZE = 16
+# How often a running ffmpeg checks whether the render was cancelled.
+CANCEL_POLL_INTERVAL = 0.5
+
+
+class RenderMode(enum.StrEnum):
+    TRANSCODE = "transcode"
+    # Stream copy the GOP aligned middle of each clip and only re-encode the
+    # crossfades between them.
+    SMART = "smart"
+    # Build the output from single keyframes sampled across the whole range, so
+    # decoding scales with the output length rather than the recorded footage.
+    HYPERLAPSE = "hyperlapse"
+
+
+@dataclass
+class MemoryProfile:
+    """
+    Peak RSS of an ffmpeg crossfade, which grows linearly with the number of
+    inputs it decodes at once.
+    """
+
+    base: int
+    per_input: int
+
+    def peak(self, inputs: int) -> int:
+        return self.base + self.per_input * inputs
+
+
+@dataclass
+class RenderPlan:
+    batch_size: int | None
+    passes: int
+    workers: int
+    peak_memory: int | None = None
+
+
+class MemoryBudget:
+    """
+    Memory shared by every timelapse rendering in this process. Each render
+    plans against the whole limit and then reserves its planned peak, waiting
+    while concurrent renders hold too much of it.
+    """
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self._reserved = 0
+        self._condition = Condition()
+
+    @contextmanager
+    def reserve(
+        self, amount: int | None, cancelled: Event | None = None
+    ) -> Iterator[None]:
+        # A render planned over the limit still runs once it has it to itself.
+        amount = min(amount or 0, self.limit)
+        with self._condition:
+            while self._reserved + amount > self.limit:
+                if cancelled is not None and cancelled.is_set():
+                    raise RuntimeError("Timelapse cancelled")
+                self._condition.wait(CANCEL_POLL_INTERVAL)
+            self._reserved += amount
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._reserved -= amount
+                self._condition.notify_all()
+
 
 def make_timelapse(
     files: list[str],
@@ -17,15 +105,31 @@ def make_timelapse(
     total_time: float | None = None,
     fade_duration: float | None = None,
     batch_size: int | None = None,
-) -> None:
+    durations: list[float | None] | None = None,
+    workers: int | None = None,
+    memory_limit: int | None = None,
+    memory_profile: MemoryProfile | None = None,
+    on_progress: Callable[[float], None] | None = None,
+    mode: RenderMode = RenderMode.TRANSCODE,
+    keyframe_intervals: list[float | None] | None = None,
+    cache: RenderCache | None = None,
+    cancelled: Event | None = None,
+    memory_budget: MemoryBudget | None = None,
+) -> RenderPlan | None:
+    if memory_budget is not None:
+        memory_limit = memory_budget.limit
     fade_duration = fade_duration if fade_duration is not None else 0
-    durations = [_get_video_duration(f) for f in files]
+    durations = _get_video_durations(files, durations or [None] * len(files))
+    keyframe_intervals = keyframe_intervals or [None] * len(files)
     durations_files = [
-        (d, f, t) for d, f, t in zip(durations, files, times) if d > fade_duration
+        (d, f, t, k)
+        for d, f, t, k in zip(durations, files, times, keyframe_intervals)
+        if d > fade_duration
     ]
-    durations = [d for d, _, _ in durations_files]
-    files = [f for _, f, _ in durations_files]
-    times = [t for _, _, t in durations_files]
+    durations = [d for d, _, _, _ in durations_files]
+    files = [f for _, f, _, _ in durations_files]
+    times = [t for _, _, t, _ in durations_files]
+    keyframe_intervals = [k for _, _, _, k in durations_files]
     minimal_compression = min(
         _minimal_compression(
             times[i],
@@ -51,6 +155,25 @@ def make_timelapse(
         compression = minimal_compression
     starts = [compression * (t - times[0]).total_seconds() for t in times]
     last_clip_duration = compression * average_clip_spacing
+    if mode == RenderMode.HYPERLAPSE:
+        plan = _hyperlapse(
+            files,
+            times,
+            durations,
+            keyframe_intervals,
+            compression,
+            starts[-1] + last_clip_duration,
+            dest,
+            workers,
+            memory_limit,
+            memory_profile,
+            on_progress,
+            cancelled,
+            memory_budget,
+        )
+        if plan is not None:
+            logging.info(f"Hyperlapse created at {dest}")
+            return plan
     if fade_duration == 0:
         logging.info("No crossfade duration specified, concatenating videos directly")
         inputs = [ffmpeg.input(str(path)) for path in files]
@@ -60,19 +183,77 @@ def make_timelapse(
                 inputs, starts, starts[1:] + [starts[-1] + last_clip_duration]
             )
         ]
-        ffmpeg.concat(*inputs).output(str(dest)).run(overwrite_output=True, quiet=True)
-        return
-    if batch_size is None:
-        logging.info("Crossfading all videos in a single pass")
-        _crossfade_videos(
-            files, starts, fade_duration, LIBX264, dest, last_clip_duration
-        )
-    else:
-        logging.info(f"Crossfading videos in batches of {batch_size}")
-        _crossfade_videos_constant_memory(
-            files, starts, last_clip_duration, fade_duration, dest, batch_size
+        _run(ffmpeg.concat(*inputs).output(str(dest)), cancelled)
+        return None
+    if memory_limit is not None and memory_profile is None:
+        memory_profile = _calibrate_memory(files, durations, cancelled)
+    if mode == RenderMode.SMART:
+        plan = _smart_render(
+            files,
+            keyframe_intervals,
+            starts,
+            last_clip_duration,
+            fade_duration,
+            dest,
+            workers,
+            memory_limit,
+            memory_profile,
+            on_progress,
+            cancelled,
+            memory_budget,
         )
+        if plan is not None:
+            logging.info(f"Timelapse created at {dest}")
+            return plan
+    plan = _plan_render(len(files), batch_size, workers, memory_limit, memory_profile)
+    logging.info(f"Render plan for {len(files)} videos: {plan}")
+    with _reserve(memory_budget, plan, cancelled):
+        if plan.batch_size is None:
+            logging.info("Crossfading all videos in a single pass")
+            _crossfade_videos(
+                files,
+                starts,
+                fade_duration,
+                LIBX264,
+                dest,
+                last_clip_duration,
+                cancelled=cancelled,
+            )
+        else:
+            logging.info(f"Crossfading videos in batches of {plan.batch_size}")
+            _crossfade_videos_constant_memory(
+                files,
+                starts,
+                last_clip_duration,
+                fade_duration,
+                dest,
+                plan.batch_size,
+                workers=plan.workers,
+                on_progress=on_progress,
+                cache=cache,
+                cancelled=cancelled,
+            )
     logging.info(f"Timelapse created at {dest}")
+    return plan
+
+
+def _reserve(
+    budget: MemoryBudget | None, plan: RenderPlan, cancelled: Event | None
+) -> ContextManager[None]:
+    if budget is None:
+        return nullcontext()
+    return budget.reserve(plan.peak_memory, cancelled)
+
+
+def _get_video_durations(
+    files: list[str], known_durations: list[float | None]
+) -> list[float]:
+    missing = [f for f, d in zip(files, known_durations) if d is None]
+    if missing:
+        logging.info(f"Probing durations of {len(missing)} videos")
+    with ThreadPoolExecutor(max_workers=PROBE_CONCURRENCY) as executor:
+        probed = iter(list(executor.map(_get_video_duration, missing)))
+    return [d if d is not None else next(probed) for d in known_durations]
 
 
 def _get_video_duration(path: str) -> float:
@@ -93,49 +274,83 @@ def _crossfade_videos_constant_memory(
     dest: Path,
     batch_size: int,
     lossless: bool = False,
+    workers: int = 1,
+    on_progress: Callable[[float], None] | None = None,
+    cache: RenderCache | None = None,
+    cancelled: Event | None = None,
 ) -> None:
     if not video_paths:
         raise ValueError("No video paths provided")
     ends = [s + fade_duration for s in starts[1:]] + [starts[-1] + last_clip_duration]
     videos_with_starts = list(zip(video_paths, starts, ends))
-    total_passes = math.ceil(math.log(len(videos_with_starts), batch_size))
-    with tempfile.TemporaryDirectory() as temp_dir:
+    codec = PRORES if lossless else LIBX264
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    logging.info(f"Rendering batches on {workers} workers, {threads} threads each")
+    total_batches = _count_batches(len(videos_with_starts), batch_size)
+    rendered_batches = 0
+    with (
+        ExitStack() as pins,
+        tempfile.TemporaryDirectory() as temp_dir,
+        ThreadPoolExecutor(max_workers=workers) as executor,
+    ):
         temp_dir_path = Path(temp_dir)
         current_videos_with_starts = videos_with_starts
-        for _pass in range(total_passes):
-            logging.info(f"Starting pass {_pass + 1} / {total_passes}")
-            next_videos_with_starts = []
-            num_batches = (
-                len(current_videos_with_starts) + batch_size - 1
-            ) // batch_size
-            for i, batch in enumerate(batched(current_videos_with_starts, batch_size)):
-                logging.info(f"Processing batch {i + 1} / {num_batches}")
+        _pass = 0
+        while len(current_videos_with_starts) > 1:
+            _pass += 1
+            batches = list(batched(current_videos_with_starts, batch_size))
+            logging.info(f"Starting pass {_pass} with {len(batches)} batches")
+            futures = []
+            for batch in batches:
                 if len(batch) == 1:
-                    next_videos_with_starts.append(batch[0])
                     continue
-                video_paths_batch = [vp for vp, _, _ in batch]
-                first_start = batch[0][1]
-                batch_starts = [s - first_start for _, s, _ in batch]
-                batch_end = batch[-1][2]
-                batch_last_clip_duration = batch_end - batch_starts[-1]
-                temp_output = temp_dir_path / f"{uuid4().hex}.mov"
-                _crossfade_videos(
-                    video_paths_batch,
-                    batch_starts,
-                    fade_duration,
-                    PRORES if lossless else LIBX264,
-                    temp_output,
-                    batch_last_clip_duration,
+                key = None
+                if cache is not None:
+                    key = _batch_key(batch, fade_duration, codec)
+                    # Outputs of this pass are inputs of the next one.
+                    cache.pin(key)
+                    pins.callback(cache.unpin, key)
+                futures.append(
+                    executor.submit(
+                        _crossfade_batch,
+                        batch,
+                        fade_duration,
+                        codec,
+                        temp_dir_path,
+                        threads,
+                        cache,
+                        key,
+                        cancelled,
+                    )
                 )
-                next_videos_with_starts.append((temp_output, first_start, batch_end))
-            current_videos_with_starts = next_videos_with_starts
+            try:
+                for future in as_completed(futures):
+                    future.result()
+                    rendered_batches += 1
+                    logging.info(f"Rendered batch {rendered_batches} / {total_batches}")
+                    if on_progress:
+                        on_progress(rendered_batches / total_batches)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+            # Batches of a single video are passed through to the next pass as is.
+            results = iter(futures)
+            current_videos_with_starts = [
+                batch[0] if len(batch) == 1 else next(results).result()
+                for batch in batches
+            ]
 
         final_video_path, final_start, _ = current_videos_with_starts[0]
         assert final_start == starts[0]
         if lossless:
             logging.info("Re-encoding final video to target format")
             _reencode_video(
-                final_video_path, dest, LIBX264, starts[-1] + last_clip_duration
+                final_video_path,
+                dest,
+                LIBX264,
+                starts[-1] + last_clip_duration,
+                cancelled,
             )
         else:
             shutil.copy(final_video_path, dest)
@@ -150,6 +365,13 @@ class Codec:
 
 LIBX264 = Codec(name="libx264", profile="main", pix_fmt="yuv420p")
 PRORES = Codec(name="prores_ks", profile="3", pix_fmt="yuv422p10le")
+# libx264 profiles for the ffprobe names of 8 bit H.264 profiles it can encode.
+X264_PROFILES = {
+    "Constrained Baseline": "baseline",
+    "Baseline": "baseline",
+    "Main": "main",
+    "High": "high",
+}
 
 
 def _crossfade_videos(
@@ -159,6 +381,8 @@ def _crossfade_videos(
     codec: Codec,
     dest: Path,
     last_clip_duration: float | None = None,
+    threads: int | None = None,
+    cancelled: Event | None = None,
 ) -> None:
     if not video_paths:
         raise ValueError("No video paths provided")
@@ -166,7 +390,23 @@ def _crossfade_videos(
         shutil.copy(video_paths[0], dest)
         return
     inputs = [ffmpeg.input(str(path)) for path in video_paths]
+    output = ffmpeg.output(
+        _xfade(inputs, starts, duration),
+        str(dest),
+        vcodec=codec.name,
+        profile=codec.profile,
+        pix_fmt=codec.pix_fmt,
+        **(
+            {"t": starts[-1] + last_clip_duration}
+            if last_clip_duration is not None
+            else {}
+        ),
+        **({"threads": threads} if threads is not None else {}),
+    )
+    _run(output, cancelled)
+
 
+def _xfade(inputs: list, starts: list[float], duration: float):
     xfade = None
     for i in range(len(inputs) - 1):
         input1 = inputs[i] if i == 0 else xfade
@@ -178,24 +418,15 @@ def _crossfade_videos(
             duration=duration,
             offset=starts[i + 1],
         )
-
-    output = ffmpeg.output(
-        xfade,
-        str(dest),
-        vcodec=codec.name,
-        profile=codec.profile,
-        pix_fmt=codec.pix_fmt,
-        **(
-            {"t": starts[-1] + last_clip_duration}
-            if last_clip_duration is not None
-            else {}
-        ),
-    )
-    ffmpeg.run(output, overwrite_output=True, quiet=True)
+    return xfade
 
 
 def _reencode_video(
-    input_path: str, output_path: Path, codec: Codec, duration: float | None = None
+    input_path: str,
+    output_path: Path,
+    codec: Codec,
+    duration: float | None = None,
+    cancelled: Event | None = None,
 ) -> None:
     input_ = ffmpeg.input(str(input_path))
     output = ffmpeg.output(
@@ -206,4 +437,577 @@ def _reencode_video(
         pix_fmt=codec.pix_fmt,
         **({"t": duration} if duration is not None else {}),
     )
-    ffmpeg.run(output, overwrite_output=True)
+    _run(output, cancelled)
+
+
+def _plan_render(
+    count: int,
+    batch_size: int | None,
+    workers: int | None,
+    memory_limit: int | None,
+    profile: MemoryProfile | None,
+) -> RenderPlan:
+    workers = workers or os.cpu_count() or 1
+    if memory_limit is None or profile is None:
+        if batch_size is None or batch_size >= count:
+            return RenderPlan(batch_size=None, passes=1, workers=1)
+        return RenderPlan(batch_size, _count_passes(count, batch_size), workers)
+    max_batch_size = (memory_limit - profile.base) // profile.per_input
+    if batch_size is None:
+        if max_batch_size < 2:
+            raise ValueError(
+                f"Memory limit {memory_limit} is too small to crossfade two videos "
+                f"with {profile}"
+            )
+        # Every pass re-encodes the whole timelapse, so the work is set by the
+        # number of passes. Among the batch sizes that need the fewest passes,
+        # the smallest leaves the most memory for rendering batches in parallel.
+        passes = _count_passes(count, min(count, max_batch_size))
+        batch_size = next(
+            b for b in range(2, count + 1) if _count_passes(count, b) == passes
+        )
+    elif batch_size > max_batch_size:
+        logging.warning(
+            f"Batch size {batch_size} exceeds the memory limit {memory_limit}, "
+            f"which fits {max_batch_size} inputs with {profile}"
+        )
+    if batch_size >= count:
+        return RenderPlan(None, 1, 1, profile.peak(count))
+    peak_memory = profile.peak(batch_size)
+    workers = max(1, min(workers, memory_limit // peak_memory))
+    return RenderPlan(
+        batch_size, _count_passes(count, batch_size), workers, peak_memory * workers
+    )
+
+
+def _count_passes(videos: int, batch_size: int) -> int:
+    passes = 0
+    while videos > 1:
+        videos = -(-videos // batch_size)
+        passes += 1
+    return passes
+
+
+def _count_batches(videos: int, batch_size: int) -> int:
+    total = 0
+    while videos > 1:
+        full_batches, remainder = divmod(videos, batch_size)
+        # A trailing batch of a single video is passed through without rendering.
+        total += full_batches + (remainder > 1)
+        videos = full_batches + (remainder > 0)
+    return total
+
+
+def _crossfade_batch(
+    batch: tuple[tuple[str, float, float], ...],
+    fade_duration: float,
+    codec: Codec,
+    temp_dir: Path,
+    threads: int,
+    cache: RenderCache | None = None,
+    key: str | None = None,
+    cancelled: Event | None = None,
+) -> tuple[Path, float, float]:
+    video_paths_batch = [vp for vp, _, _ in batch]
+    first_start = batch[0][1]
+    batch_starts = [s - first_start for _, s, _ in batch]
+    batch_end = batch[-1][2]
+    batch_last_clip_duration = batch_end - batch_starts[-1]
+    if cache is not None and key is not None:
+        if cached := cache.get(key):
+            logging.info(f"Reusing cached render {key}")
+            return cached, first_start, batch_end
+        temp_output = cache.temp_path(key)
+    else:
+        temp_output = temp_dir / f"{uuid4().hex}.mov"
+    try:
+        _crossfade_videos(
+            video_paths_batch,
+            batch_starts,
+            fade_duration,
+            codec,
+            temp_output,
+            batch_last_clip_duration,
+            threads,
+            cancelled,
+        )
+    except BaseException:
+        temp_output.unlink(missing_ok=True)
+        raise
+    if cache is not None and key is not None:
+        return cache.put(key, temp_output), first_start, batch_end
+    return temp_output, first_start, batch_end
+
+
+def _batch_key(
+    batch: tuple[tuple[str, float, float], ...], fade_duration: float, codec: Codec
+) -> str:
+    """
+    Identify a batch render by its inputs and their placement relative to the
+    batch, so the same batch in a rerun or an overlapping range hits the cache.
+    Intermediate inputs are cache paths, which are keys themselves.
+    """
+    first_start = batch[0][1]
+    description = [
+        [str(path), round(start - first_start, 6), round(end - first_start, 6)]
+        for path, start, end in batch
+    ]
+    description.append([round(fade_duration, 6), asdict(codec)])
+    return hashlib.sha256(json.dumps(description).encode()).hexdigest()
+
+
+def _calibrate_memory(
+    files: list[str], durations: list[float], cancelled: Event | None = None
+) -> MemoryProfile:
+    sample = min(len(files), CALIBRATION_INPUTS)
+    step = min(1.0, min(durations[:sample]) / 2)
+    counts = sorted({2, sample})
+    peaks = [_measure_peak_memory(files[:k], step, cancelled) for k in counts]
+    if len(peaks) == 1:
+        profile = MemoryProfile(base=0, per_input=peaks[0] // counts[0])
+    else:
+        per_input = max(1, (peaks[1] - peaks[0]) // (counts[1] - counts[0]))
+        profile = MemoryProfile(max(0, peaks[0] - per_input * counts[0]), per_input)
+    logging.info(f"Calibrated crossfade memory on {counts} inputs: {profile}")
+    return profile
+
+
+def _measure_peak_memory(
+    files: list[str], step: float, cancelled: Event | None = None
+) -> int:
+    inputs = [ffmpeg.input(str(path)) for path in files]
+    starts = [i * step for i in range(len(files))]
+    _, stderr = _run(
+        ffmpeg.output(
+            _xfade(inputs, starts, step / 2),
+            "-",
+            f="null",
+            vcodec=LIBX264.name,
+            profile=LIBX264.profile,
+            pix_fmt=LIBX264.pix_fmt,
+            t=starts[-1] + step,
+        ).global_args("-benchmark"),
+        cancelled,
+    )
+    match = re.search(rb"maxrss=(\d+)(KiB|kB)", stderr)
+    if match is None:
+        raise RuntimeError("ffmpeg did not report its peak memory usage")
+    return int(match.group(1)) * 1024
+
+
+@dataclass
+class _Piece:
+    # Clips as (path, in point, out point) that are crossfaded and re-encoded, or a
+    # single clip stream copied from its in point for the given number of packets.
+    clips: list[tuple[str, float, float]]
+    packets: int | None = None
+
+
+def _smart_render(
+    files: list[str],
+    keyframe_intervals: list[float | None],
+    starts: list[float],
+    last_clip_duration: float,
+    fade_duration: float,
+    dest: Path,
+    workers: int | None,
+    memory_limit: int | None,
+    memory_profile: MemoryProfile | None,
+    on_progress: Callable[[float], None] | None,
+    cancelled: Event | None,
+    memory_budget: MemoryBudget | None = None,
+) -> RenderPlan | None:
+    with ThreadPoolExecutor(max_workers=PROBE_CONCURRENCY) as executor:
+        streams = list(executor.map(probe_video_stream, files))
+    formats = {
+        (
+            s.codec,
+            s.profile,
+            s.level,
+            s.width,
+            s.height,
+            s.pix_fmt,
+            s.frame_rate,
+            s.extradata_hash,
+        )
+        for s in streams
+    }
+    source = streams[0]
+    if (
+        len(formats) != 1
+        or source.codec != "h264"
+        or source.profile not in X264_PROFILES
+        or not source.level
+        or source.pix_fmt != LIBX264.pix_fmt
+        or source.frame_rate in (None, "0/0")
+    ):
+        logging.info(f"Cannot stream copy inputs with formats {formats}, transcoding")
+        return None
+    pieces = _smart_pieces(
+        files,
+        keyframe_intervals,
+        Fraction(source.frame_rate),
+        starts,
+        last_clip_duration,
+        fade_duration,
+    )
+    if not _cuts_on_keyframes(pieces, streams, files, Fraction(source.frame_rate)):
+        return None
+    longest = max((len(p.clips) for p in pieces if p.packets is None), default=1)
+    workers = workers or os.cpu_count() or 1
+    peak_memory = None
+    if memory_limit is not None and memory_profile is not None:
+        peak_memory = memory_profile.peak(longest)
+        workers = max(1, min(workers, memory_limit // peak_memory))
+        peak_memory *= workers
+    plan = RenderPlan(
+        batch_size=None, passes=1, workers=workers, peak_memory=peak_memory
+    )
+    copied = sum(p.packets is not None for p in pieces)
+    logging.info(
+        f"Render plan for {len(files)} videos: {plan}, "
+        f"{copied} stream copied and {len(pieces) - copied} re-encoded pieces"
+    )
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    with (
+        _reserve(memory_budget, plan, cancelled),
+        tempfile.TemporaryDirectory() as temp_dir,
+    ):
+        outputs = [Path(temp_dir) / f"{i:06d}.mp4" for i in range(len(pieces))]
+        _render_in_parallel(
+            [
+                partial(
+                    _render_piece,
+                    piece,
+                    fade_duration,
+                    source,
+                    output,
+                    threads,
+                    cancelled,
+                )
+                for piece, output in zip(pieces, outputs)
+            ],
+            workers,
+            on_progress,
+        )
+        _concat_files(outputs, dest, cancelled)
+    return plan
+
+
+def _smart_pieces(
+    files: list[str],
+    keyframe_intervals: list[float | None],
+    frame_rate: Fraction,
+    starts: list[float],
+    last_clip_duration: float,
+    fade_duration: float,
+) -> list[_Piece]:
+    ends = [s + fade_duration for s in starts[1:]] + [starts[-1] + last_clip_duration]
+    pieces = []
+    crossfaded: list[tuple[str, float, float]] = []
+    for i, (path, interval, start, end) in enumerate(
+        zip(files, keyframe_intervals, starts, ends)
+    ):
+        length = end - start
+        # Only the part of a clip that is not faded in or out can be copied.
+        head = fade_duration if i > 0 else 0.0
+        tail = length - fade_duration if i < len(files) - 1 else length
+        keyframes = _keyframe_grid(interval, frame_rate, head, tail)
+        if len(keyframes) < 2:
+            crossfaded.append((path, 0.0, length))
+            continue
+        (first, first_packet), (last, last_packet) = keyframes[0], keyframes[-1]
+        crossfaded.append((path, 0.0, first))
+        pieces.append(_Piece(crossfaded))
+        pieces.append(_Piece([(path, first, last)], last_packet - first_packet))
+        crossfaded = [(path, last, length)]
+    pieces.append(_Piece(crossfaded))
+    # The first clip may be copied from its start and the last one to its end.
+    for piece in pieces:
+        piece.clips = [c for c in piece.clips if c[2] > c[1]]
+    return [piece for piece in pieces if piece.clips]
+
+
+def _cuts_on_keyframes(
+    pieces: list[_Piece],
+    streams: list[VideoStream],
+    files: list[str],
+    frame_rate: Fraction,
+) -> bool:
+    """
+    Check that every stream copied piece starts and ends on a real keyframe
+    where the keyframe interval predicts one. A variable GOP, such as from
+    scene cut keyframes, would otherwise make -ss snap elsewhere.
+    """
+    start_times = {path: stream.start_time for path, stream in zip(files, streams)}
+    half_frame = float(1 / (2 * frame_rate))
+    cuts = [
+        (path, [start_times[path] + in_point, start_times[path] + out_point])
+        for piece in pieces
+        if piece.packets is not None
+        for path, in_point, out_point in piece.clips
+    ]
+    with ThreadPoolExecutor(max_workers=PROBE_CONCURRENCY) as executor:
+        found = list(
+            executor.map(
+                lambda cut: probe_keyframes_before(
+                    cut[0], [t + half_frame for t in cut[1]]
+                ),
+                cuts,
+            )
+        )
+    for (path, times), keyframes in zip(cuts, found):
+        if any(k is None or abs(k - t) > half_frame for k, t in zip(keyframes, times)):
+            logging.info(
+                f"Keyframes of {path} are not at a fixed interval, transcoding"
+            )
+            return False
+    return True
+
+
+def _keyframe_grid(
+    interval: float | None, frame_rate: Fraction, head: float, tail: float
+) -> list[tuple[float, int]]:
+    """
+    Time and frame index of the keyframes between head and tail of a recording
+    with a fixed keyframe interval, starting on a keyframe at its first frame.
+    """
+    if not interval:
+        return []
+    gop = round(interval * frame_rate)
+    if gop < 1:
+        return []
+    first = math.ceil(Fraction(head) * frame_rate / gop)
+    last = math.floor(Fraction(tail) * frame_rate / gop)
+    return [(float(j * gop / frame_rate), j * gop) for j in range(first, last + 1)]
+
+
+def _render_piece(
+    piece: _Piece,
+    fade_duration: float,
+    source: VideoStream,
+    dest: Path,
+    threads: int,
+    cancelled: Event | None = None,
+) -> None:
+    if piece.packets is not None:
+        path, in_point, _ = piece.clips[0]
+        # Seek to the keyframe itself, never the one before it.
+        ss = f"{math.ceil(in_point * 1_000_000) / 1_000_000:.6f}"
+        _run(
+            ffmpeg.input(path, ss=ss).output(
+                str(dest), c="copy", an=None, **{"frames:v": piece.packets}
+            ),
+            cancelled,
+        )
+        return
+    inputs = [
+        ffmpeg.input(path, ss=in_point, t=out_point - in_point)
+        for path, in_point, out_point in piece.clips
+    ]
+    offsets = [0.0]
+    for _, in_point, out_point in piece.clips[:-1]:
+        offsets.append(offsets[-1] + out_point - in_point - fade_duration)
+    _, in_point, out_point = piece.clips[-1]
+    if len(inputs) > 1:
+        stream = _xfade(inputs, offsets, fade_duration)
+    else:
+        stream = inputs[0].video
+    # Match the copied parts so the concatenated stream keeps one profile and
+    # level. Each piece's own parameter sets are carried in band by the concat
+    # demuxer's h264_mp4toannexb conversion.
+    _run(
+        ffmpeg.output(
+            stream,
+            str(dest),
+            vcodec=LIBX264.name,
+            profile=X264_PROFILES[source.profile],
+            level=source.level,
+            pix_fmt=LIBX264.pix_fmt,
+            t=offsets[-1] + out_point - in_point,
+            threads=threads,
+            r=source.frame_rate,
+        ),
+        cancelled,
+    )
+
+
+def _hyperlapse(
+    files: list[str],
+    times: list[datetime],
+    durations: list[float],
+    keyframe_intervals: list[float | None],
+    compression: float,
+    total_time: float,
+    dest: Path,
+    workers: int | None,
+    memory_limit: int | None,
+    memory_profile: MemoryProfile | None,
+    on_progress: Callable[[float], None] | None,
+    cancelled: Event | None,
+    memory_budget: MemoryBudget | None = None,
+) -> RenderPlan | None:
+    known_intervals = sorted(k for k in keyframe_intervals if k)
+    keyframe_interval = (
+        known_intervals[len(known_intervals) // 2] if known_intervals else None
+    )
+    sample_interval = 1 / (HYPERLAPSE_FRAME_RATE * compression)
+    if keyframe_interval is not None and sample_interval < keyframe_interval:
+        logging.info(
+            f"Sampling every {sample_interval:.2f}s of recording is denser than "
+            f"keyframes every {keyframe_interval:.2f}s, rendering clips instead"
+        )
+        return None
+    samples = _hyperlapse_samples(
+        files,
+        times,
+        durations,
+        keyframe_interval,
+        sample_interval,
+        round(total_time * HYPERLAPSE_FRAME_RATE),
+    )
+    chunks = list(batched(samples, HYPERLAPSE_CHUNK_SIZE))
+    workers = workers or os.cpu_count() or 1
+    peak_memory = None
+    if memory_limit is not None:
+        memory_profile = memory_profile or _calibrate_memory(
+            files, durations, cancelled
+        )
+        peak_memory = memory_profile.peak(HYPERLAPSE_CHUNK_SIZE)
+        workers = max(1, min(workers, memory_limit // peak_memory))
+        peak_memory *= workers
+    plan = RenderPlan(
+        batch_size=HYPERLAPSE_CHUNK_SIZE,
+        passes=1,
+        workers=workers,
+        peak_memory=peak_memory,
+    )
+    logging.info(
+        f"Render plan for {len(files)} videos: {plan}, sampling every "
+        f"{sample_interval:.1f}s into {len(samples)} distinct keyframes"
+    )
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    with (
+        _reserve(memory_budget, plan, cancelled),
+        tempfile.TemporaryDirectory() as temp_dir,
+    ):
+        outputs = [Path(temp_dir) / f"{i:06d}.mp4" for i in range(len(chunks))]
+        _render_in_parallel(
+            [
+                partial(_render_samples, chunk, output, threads, cancelled)
+                for chunk, output in zip(chunks, outputs)
+            ],
+            workers,
+            on_progress,
+        )
+        _concat_files(outputs, dest, cancelled)
+    return plan
+
+
+def _hyperlapse_samples(
+    files: list[str],
+    times: list[datetime],
+    durations: list[float],
+    keyframe_interval: float | None,
+    sample_interval: float,
+    frames: int,
+) -> list[tuple[str, float, int]]:
+    """
+    Map every output frame to the recording that covers its point in time, or
+    the last one before it, as (path, offset, repeat count) with consecutive
+    frames showing the same keyframe merged so it is only decoded once.
+    """
+    samples: list[tuple[str, float, int]] = []
+    for frame in range(frames):
+        time = times[0] + timedelta(seconds=frame * sample_interval)
+        i = bisect_right(times, time) - 1
+        offset = min((time - times[i]).total_seconds(), durations[i])
+        if keyframe_interval is not None:
+            # Fast seeking lands on the keyframe at or before the offset.
+            offset = keyframe_interval * math.floor(offset / keyframe_interval)
+        if samples and samples[-1][:2] == (files[i], offset):
+            samples[-1] = (files[i], offset, samples[-1][2] + 1)
+        else:
+            samples.append((files[i], offset, 1))
+    return samples
+
+
+def _render_samples(
+    samples: tuple[tuple[str, float, int], ...],
+    dest: Path,
+    threads: int,
+    cancelled: Event | None = None,
+) -> None:
+    streams = []
+    for path, offset, count in samples:
+        stream = ffmpeg.input(
+            path, ss=offset, noaccurate_seek=None, skip_frame="nokey"
+        ).video.trim(end_frame=1)
+        if count > 1:
+            stream = stream.filter("loop", loop=count - 1, size=1)
+        streams.append(stream)
+    _run(
+        ffmpeg.concat(*streams, v=1, a=0)
+        .filter("setpts", f"N/({HYPERLAPSE_FRAME_RATE}*TB)")
+        .output(
+            str(dest),
+            vcodec=LIBX264.name,
+            profile=LIBX264.profile,
+            pix_fmt=LIBX264.pix_fmt,
+            r=HYPERLAPSE_FRAME_RATE,
+            threads=threads,
+        ),
+        cancelled,
+    )
+
+
+def _render_in_parallel(
+    renders: list[Callable[[], None]],
+    workers: int,
+    on_progress: Callable[[float], None] | None,
+) -> None:
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(render) for render in renders]
+        try:
+            for rendered, future in enumerate(as_completed(futures), start=1):
+                future.result()
+                if on_progress:
+                    on_progress(rendered / len(futures))
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+
+def _concat_files(
+    paths: list[Path], dest: Path, cancelled: Event | None = None
+) -> None:
+    concat_list = paths[0].parent / "concat.txt"
+    concat_list.write_text("".join(f"file '{path}'\n" for path in paths))
+    _run(
+        ffmpeg.input(str(concat_list), f="concat", safe=0).output(str(dest), c="copy"),
+        cancelled,
+    )
+
+
+def _run(stream_spec, cancelled: Event | None = None) -> tuple[bytes, bytes]:
+    """
+    Run ffmpeg quietly like ffmpeg.run, killing it as soon as cancelled is set.
+    """
+    if cancelled is not None and cancelled.is_set():
+        raise RuntimeError("Timelapse cancelled")
+    process = ffmpeg.run_async(
+        stream_spec, pipe_stdout=True, pipe_stderr=True, overwrite_output=True
+    )
+    while True:
+        try:
+            stdout, stderr = process.communicate(timeout=CANCEL_POLL_INTERVAL)
+            break
+        except subprocess.TimeoutExpired:
+            if cancelled is not None and cancelled.is_set():
+                process.kill()
+                process.communicate()
+                raise RuntimeError("Timelapse cancelled")
+    if process.returncode:
+        raise ffmpeg.Error("ffmpeg", stdout, stderr)
+    return stdout, stderr